@@ -1,48 +1,122 @@
-import nest_asyncio
 import dotenv
-nest_asyncio.apply()
 dotenv.load_dotenv()
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
-from ReportGenerator import DocumentProcessor
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from ReportGenerator import DocumentProcessor, KYCbatchreport, screen_entity, web_fetcher, sanctions_index, is_partial_report
+from JobQueue import JobStore, JobQueue
+from contextlib import asynccontextmanager
 import uvicorn
-from langchain_community.llms.bedrock import Bedrock
-from pydantic import BaseModel
+from pydantic import BaseModel, constr, conlist
 import logging
 import os
-from anthropic import AsyncAnthropicBedrock
-
-class EntityName(BaseModel):
-    entity_name: str
+import json
+import asyncio
+from RateLimiter import is_throttling_error
+from SearchBackends import SearchUnavailableError
+from Clients import clients
+from Metrics import metrics_payload
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 GOOGLE_CSE_ID=os.getenv('google_cse_id')
 GOOGLE_API_KEY=os.getenv('google_api_key')
-aws_access_key_id = os.getenv('aws_access_key_id')
-aws_secret_access_key = os.getenv('aws_secret_access_key')
-aws_session_token = os.getenv('aws_session_token')
+BATCH_CONCURRENCY = int(os.getenv('batch_concurrency', '8'))
+JOB_WORKERS = int(os.getenv('job_workers', '4'))
+JOB_STORE_PATH = os.getenv('job_store_path', '.kyc_cache/jobs.sqlite')
+BATCH_MAX_ENTITIES = int(os.getenv('batch_max_entities', '100'))
+
+# a blank name would search the risk key words alone and report on whatever they find
+EntityNameText = constr(strip_whitespace=True, min_length=1)
+
+class EntityName(BaseModel):
+    entity_name: EntityNameText
+
+class EntityBatch(BaseModel):
+    entity_names: conlist(EntityNameText, min_length=1, max_length=BATCH_MAX_ENTITIES)
+
+# shared by every batch request so the whole process never runs more than BATCH_CONCURRENCY screenings
+batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+clients.register('job_queue', lambda: JobQueue(JobStore(JOB_STORE_PATH), workers=JOB_WORKERS))
 
-client = AsyncAnthropicBedrock(
-    aws_access_key=aws_access_key_id,
-    aws_secret_key=aws_secret_access_key,
-    aws_session_token=aws_session_token,
-    aws_region="us-east-1"
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the Bedrock client and the job store are built here rather than at import, so that importing the app stays fast
+    # and leaves no file behind
+    clients.anthropic()
+    await sanctions_index.arefresh()
+    job_queue = clients.get('job_queue')
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await clients.aclose()
+    # the fetcher's keep-alive connections are shared by every request, close them with the process
+    await web_fetcher.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 @app.post("/process")
 async def process_entity(input: EntityName): 
     entity_name = input.entity_name  
     try:
         key_words='fraud, corruption'
-        processor = DocumentProcessor(entity=entity_name, client=client, key_words=key_words)
-        processor.load_documents
-        report, risk_class = await processor.process_documents()
-        return JSONResponse(content={"summary": report, "class": risk_class})
+        report, risk_class = await screen_entity(entity_name, clients.anthropic(), key_words)
+        return JSONResponse(content={"summary": report, "class": risk_class, "partial": is_partial_report(report)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="The report could not be generated within the latency budget")
+    except SearchUnavailableError as e:
+        raise HTTPException(status_code=503, detail=f"Web search unavailable, retry later: {e}", headers={"Retry-After": "30"})
     except Exception as e:
+        if is_throttling_error(e):
+            raise HTTPException(status_code=503, detail="Bedrock quota exhausted, retry later", headers={"Retry-After": "30"})
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/process/stream")
+async def process_entity_stream(input: EntityName):
+    key_words='fraud, corruption'
+    processor = DocumentProcessor(entity=input.entity_name, client=clients.anthropic(), key_words=key_words)
+
+    async def events():
+        try:
+            async for event, data in processor.stream_documents():
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            logging.error(f"Streaming of {input.entity_name} failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/process/batch")
+async def process_batch(input: EntityBatch):
+    key_words='fraud, corruption'
+    outcomes = await KYCbatchreport(entities=input.entity_names, client=clients.anthropic(), key_words=key_words, semaphore=batch_semaphore)
+    results = []
+    for entity_name, outcome in zip(input.entity_names, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(f"Screening of {entity_name} failed: {outcome}")
+            results.append({"entity_name": entity_name, "error": str(outcome)})
+        else:
+            report, risk_class = outcome
+            results.append({"entity_name": entity_name, "summary": report, "class": risk_class, "partial": is_partial_report(report)})
+    return JSONResponse(content={"results": results})
+
+@app.post("/jobs", status_code=202)
+async def submit_job(input: EntityName):
+    key_words='fraud, corruption'
+    job_id = clients.get('job_queue').submit(input.entity_name, key_words)
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = clients.get('job_queue').store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
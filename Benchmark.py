@@ -0,0 +1,559 @@
+"""Offline end-to-end benchmark of the KYC pipeline.
+
+DuckDuckGo, the web and Bedrock are replaced by local stand-ins: a fake AsyncDDGS returning links to a local HTTP
+server that serves a synthetic corpus of articles, and a fake AsyncAnthropicBedrock with configurable latency,
+generation speed and throttling, which also answers packed summarize requests and batch jobs. The benchmark screens a set of synthetic entities at a given concurrency, either
+through ReportGenerator.screen_entity, through the FastAPI /process endpoint or through the worker processes of
+BulkScreening, and reports latency percentiles, throughput, LLM calls and tokens per entity.
+
+    python Benchmark.py --entities 50 --concurrency 10 --target processor
+    python Benchmark.py --entities 50 --concurrency 10 --target api --throttle-above 8
+    python Benchmark.py --entities 10 --duplicates 5 --concurrency 50
+    python Benchmark.py --entities 200 --concurrency 8 --target bulk --workers 4
+    python Benchmark.py --entities 50 --pack-tokens 0
+    python Benchmark.py --entities 50 --summary-batch
+    python Benchmark.py --import-budget 1.5
+"""
+import os
+import sys
+import json
+import time
+import re
+import random
+import shutil
+import asyncio
+import hashlib
+import argparse
+import subprocess
+import tempfile
+import threading
+import contextvars
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# the caches of the pipeline must not leak between runs nor into the working copy
+BENCHMARK_DIR = tempfile.mkdtemp(prefix='kyc-benchmark-')
+os.environ['page_cache_dir'] = os.path.join(BENCHMARK_DIR, 'pages')
+os.environ['summary_cache'] = 'memory'
+os.environ['job_store_path'] = os.path.join(BENCHMARK_DIR, 'jobs.sqlite')
+os.environ['report_store_path'] = os.path.join(BENCHMARK_DIR, 'reports.sqlite')
+os.environ['sanctions_dir'] = os.path.join(BENCHMARK_DIR, 'sanctions')
+
+import httpx
+import anthropic
+
+current_entity = contextvars.ContextVar('current_entity', default=None)
+
+RISK_SENTENCES = [
+    "{entity} was fined by the regulator for fraud and false accounting in {country}.",
+    "Prosecutors in {country} opened a corruption investigation into {entity} over bribes paid to officials.",
+    "The Treasury added {entity} to its sanctions list for money laundering on behalf of a sanctioned bank.",
+    "Former executives of {entity} were charged with financial crimes and tax evasion.",
+]
+NEUTRAL_SENTENCES = [
+    "{entity} reported quarterly revenue in line with analyst expectations.",
+    "{entity} opened a new office in {country} and plans to hire two hundred people.",
+    "The chief executive of {entity} spoke at an industry conference about the energy transition.",
+    "Shares of {entity} closed slightly higher on Monday.",
+]
+BOILERPLATE = ["Home", "News", "Markets", "Sport", "Subscribe to our newsletter", "Cookie settings", "Most read",
+               "Follow us on social media", "Terms of use", "Advertisement"]
+COUNTRIES = ["Brazil", "Nigeria", "Switzerland", "Malaysia", "the United Kingdom", "Venezuela", "France"]
+
+def entity_names(count: int):
+    return [f"Entity {i:04d} Holdings" for i in range(count)]
+
+def article(entity: str, index: int, adverse: bool, paragraphs: int) -> str:
+    """ Returns the HTML of a synthetic news article about an entity, with navigation and footer boilerplate around the story
+    """
+    rng = random.Random(f"{entity}-{index}")
+    sentences = RISK_SENTENCES + NEUTRAL_SENTENCES if adverse else NEUTRAL_SENTENCES
+    body = []
+    for _ in range(paragraphs):
+        text = ' '.join(rng.choice(sentences).format(entity=entity, country=rng.choice(COUNTRIES)) for _ in range(4))
+        filler = ' '.join(rng.choice(["markets", "analysts", "investors", "growth", "quarter", "board"]) for _ in range(40))
+        body.append(f"<p>{text} {filler}</p>")
+    nav = ''.join(f"<li>{item}</li>" for item in BOILERPLATE)
+    return (f"<html lang='en'><head><title>{entity} news {index}</title><script>var tracking = 1;</script></head>"
+            f"<body><nav><ul>{nav}</ul></nav><article>{''.join(body)}</article><footer>{nav}</footer></body></html>")
+
+class Corpus:
+    """Synthetic articles of every entity, some adverse, and one story syndicated by a second outlet."""
+    def __init__(self, pages_per_entity: int, paragraphs: int):
+        self.pages_per_entity = pages_per_entity
+        self.paragraphs = paragraphs
+
+    def page(self, path: str):
+        parts = path.strip('/').split('/')
+        if len(parts) != 3 or parts[0] not in ('article', 'syndicated'):
+            return None
+        entity = parts[1].replace('-', ' ')
+        index = int(parts[2])
+        # a third of the entities have adverse media, and their first story is republished by another outlet
+        adverse = int(hashlib.md5(entity.encode()).hexdigest(), 16) % 3 == 0 and index % 2 == 0
+        return article(entity, index if parts[0] == 'article' else 0, adverse, self.paragraphs)
+
+    def snippet(self, url: str) -> str:
+        """ Returns the start of the story of a page, like the snippet of a search result
+        """
+        html = self.page(url.split('/', 3)[-1]) or ''
+        start = html.find('<article><p>') + len('<article><p>')
+        return html[start:start + 240]
+
+    def links(self, base_url: str, entity: str, query: str, max_results: int):
+        slug = entity.replace(' ', '-')
+        offset = int(hashlib.md5(query.encode()).hexdigest(), 16) % self.pages_per_entity
+        links = [f"{base_url}/article/{slug}/{(offset + i) % self.pages_per_entity}" for i in range(max_results)]
+        if offset == 0:
+            links.append(f"{base_url}/syndicated/{slug}/0")
+        return links
+
+class CorpusServer:
+    """Local HTTP server of the corpus, run in a background thread, with an optional per-request latency, constant or
+    drawn from an exponential distribution of that mean."""
+    def __init__(self, corpus: Corpus, latency: float, exponential: bool = False):
+        corpus_ = corpus
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                if latency:
+                    time.sleep(random.expovariate(1 / latency) if exponential else latency)
+                html = corpus_.page(self.path)
+                if html is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = html.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', '"' + hashlib.md5(body).hexdigest() + '"')
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+def fake_ddgs(corpus: Corpus, base_url: str, entities, latency: float, exponential: bool = False):
+    """ Returns a stand-in of duckduckgo_search.AsyncDDGS answering from the corpus
+    """
+    class FakeAsyncDDGS:
+        calls = 0
+        def __init__(self, proxy=None, **kwargs):
+            pass
+        async def text(self, keywords, region=None, safesearch=None, max_results=10, **kwargs):
+            FakeAsyncDDGS.calls += 1
+            await asyncio.sleep(random.expovariate(1 / latency) if exponential and latency else latency)
+            entity = next((name for name in entities if name.lower() in keywords.lower()), None)
+            if entity is None:
+                return []
+            return [{"title": f"{entity} news {i}", "href": href, "body": corpus.snippet(href)}
+                    for i, href in enumerate(corpus.links(base_url, entity, keywords, max_results))]
+    return FakeAsyncDDGS
+
+class Usage:
+    def __init__(self, input_tokens: int, output_tokens: int):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+class TextBlock:
+    def __init__(self, text: str):
+        self.type = 'text'
+        self.text = text
+
+class Message:
+    def __init__(self, text: str, input_tokens: int, output_tokens: int):
+        self.content = [TextBlock(text)]
+        self.usage = Usage(input_tokens, output_tokens)
+
+class LLMStats:
+    def __init__(self):
+        self.calls = 0
+        self.throttled = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.in_flight = 0
+        self.per_entity = {}
+        self.batch_requests = 0
+        self.batch_input_tokens = 0
+        self.batch_output_tokens = 0
+
+    def record(self, input_tokens: int, output_tokens: int):
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        entity = current_entity.get()
+        if entity is not None:
+            stats = self.per_entity.setdefault(entity, {'calls': 0, 'input_tokens': 0, 'output_tokens': 0})
+            stats['calls'] += 1
+            stats['input_tokens'] += input_tokens
+            stats['output_tokens'] += output_tokens
+
+class FakeMessages:
+    def __init__(self, bedrock):
+        self.bedrock = bedrock
+        self.batches = FakeBatches(self)
+
+    def _reply(self, prompt: str, max_tokens: int) -> str:
+        words = min(max_tokens, self.bedrock.output_tokens)
+        if 'generates well-structured analysis reports' in prompt:
+            return "The web search report and the risk level: " + ' '.join(['finding'] * words) + "\nMedium"
+        ids = re.findall(r'<document id="(\d+)"', prompt)
+        if ids:
+            # a packed request gets one tagged summary per document, within the output limit of the request
+            words = min(self.bedrock.output_tokens, max_tokens // len(ids))
+            return '\n'.join(f'<summary id="{i}">' + ' '.join(['fact'] * words) + ' http://source.example</summary>' for i in ids)
+        return ' '.join(['fact'] * words) + " http://source.example"
+
+    def _admit(self):
+        if self.bedrock.throttle_above and self.bedrock.stats.in_flight >= self.bedrock.throttle_above \
+                or self.bedrock.rng.random() < self.bedrock.throttle_rate:
+            self.bedrock.stats.throttled += 1
+            response = httpx.Response(429, request=httpx.Request('POST', 'https://bedrock-runtime.us-east-1.amazonaws.com'))
+            raise anthropic.RateLimitError('ThrottlingException: Too many requests, please wait before trying again.',
+                                           response=response, body=None)
+
+    async def create(self, model, max_tokens, messages, **kwargs):
+        self._admit()
+        prompt = ''.join(str(message['content']) for message in messages)
+        text = self._reply(prompt, max_tokens)
+        input_tokens, output_tokens = len(prompt) // 4, len(text.split())
+        self.bedrock.stats.in_flight += 1
+        try:
+            stall = self.bedrock.slow_latency if self.bedrock.rng.random() < self.bedrock.slow_rate else 0
+            await asyncio.sleep(self.bedrock.latency + stall + output_tokens / self.bedrock.tokens_per_second)
+        finally:
+            self.bedrock.stats.in_flight -= 1
+        self.bedrock.stats.record(input_tokens, output_tokens)
+        return Message(text, input_tokens, output_tokens)
+
+    def stream(self, model, max_tokens, messages, **kwargs):
+        return FakeStream(self, model, max_tokens, messages)
+
+class FakeBatches:
+    """Stand-in of messages.batches of the Anthropic API: a batch ends `latency` seconds after its creation, every
+    request succeeding, and is counted apart from the interactive calls."""
+    def __init__(self, messages: FakeMessages):
+        self.messages = messages
+        self.batches = {}
+
+    async def create(self, requests):
+        bedrock = self.messages.bedrock
+        results = []
+        for request in requests:
+            params = request['params']
+            prompt = ''.join(str(message['content']) for message in params['messages'])
+            text = self.messages._reply(prompt, params['max_tokens'])
+            bedrock.stats.batch_requests += 1
+            bedrock.stats.batch_input_tokens += len(prompt) // 4
+            bedrock.stats.batch_output_tokens += len(text.split())
+            results.append(SimpleNamespace(custom_id=request['custom_id'],
+                                           result=SimpleNamespace(type='succeeded', message=Message(text, len(prompt) // 4, len(text.split())))))
+        batch_id = f"msgbatch_{len(self.batches)}"
+        self.batches[batch_id] = (time.monotonic() + bedrock.latency, results)
+        return await self.retrieve(batch_id)
+
+    async def retrieve(self, batch_id):
+        ends_at, results = self.batches[batch_id]
+        status = 'ended' if time.monotonic() >= ends_at else 'in_progress'
+        return SimpleNamespace(id=batch_id, processing_status=status, request_counts={'requests': len(results)})
+
+    async def results(self, batch_id):
+        async def entries():
+            for entry in self.batches[batch_id][1]:
+                yield entry
+        return entries()
+
+class FakeStream:
+    def __init__(self, messages: FakeMessages, model, max_tokens, prompt_messages):
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.prompt = ''.join(str(message['content']) for message in prompt_messages)
+
+    async def __aenter__(self):
+        self.messages._admit()
+        self.messages.bedrock.stats.in_flight += 1
+        await asyncio.sleep(self.messages.bedrock.latency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.messages.bedrock.stats.in_flight -= 1
+        return False
+
+    async def get_final_message(self):
+        text = self.messages._reply(self.prompt, self.max_tokens)
+        return Message(text, len(self.prompt) // 4, len(text.split()))
+
+    @property
+    def text_stream(self):
+        async def fragments():
+            bedrock = self.messages.bedrock
+            text = self.messages._reply(self.prompt, self.max_tokens)
+            words = text.split(' ')
+            for word in words:
+                await asyncio.sleep(1 / bedrock.tokens_per_second)
+                yield word + ' '
+            bedrock.stats.record(len(self.prompt) // 4, len(words))
+        return fragments()
+
+class FakeAsyncAnthropicBedrock:
+    """Stand-in of anthropic.AsyncAnthropicBedrock for messages.create and messages.stream, and of the messages.batches
+    of the Anthropic API.
+    A call takes `latency` seconds plus its output tokens at `tokens_per_second`, and `slow_latency` more seconds with
+    probability `slow_rate`; it is throttled with a 429 when `throttle_above` calls are already running or with
+    probability `throttle_rate`."""
+    def __init__(self, latency: float = 0.5, tokens_per_second: float = 200, output_tokens: int = 200,
+                 throttle_above: int = 0, throttle_rate: float = 0.0, seed: int = 0, slow_rate: float = 0.0,
+                 slow_latency: float = 0.0):
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.throttle_above = throttle_above
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.stats = LLMStats()
+        self.messages = FakeMessages(self)
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+async def screen_with_processor(entity: str, client, key_words: str):
+    import ReportGenerator
+    return await ReportGenerator.screen_entity(entity, client, key_words)
+
+def install_fakes(args, base_url: str, entities, workers: int = 1):
+    """ Replaces DuckDuckGo and Bedrock by their stand-ins in the current process, giving it its share of the rate limit
+    """
+    import ReportGenerator
+    import SearchBackends
+    from Clients import clients
+    from RateLimiter import RateLimiter, RateLimitedClient
+
+    corpus = Corpus(pages_per_entity=args.pages_per_entity, paragraphs=args.paragraphs)
+    SearchBackends.AsyncDDGS = fake_ddgs(corpus, base_url, entities, latency=args.search_latency,
+                                          exponential=args.exponential_latency)
+    # every page of the corpus lives on one local host, lift the per-host politeness meant for real sites
+    ReportGenerator.web_fetcher.per_host = args.concurrency * 8
+    ReportGenerator.web_fetcher.politeness_delay = 0
+
+    bedrock = FakeAsyncAnthropicBedrock(latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second,
+                                        output_tokens=args.llm_output_tokens, throttle_above=args.throttle_above,
+                                        throttle_rate=args.throttle_rate, seed=args.seed, slow_rate=args.llm_slow_rate,
+                                        slow_latency=args.llm_slow_latency)
+    limiter = RateLimiter(requests_per_second=args.rps / workers, tokens_per_minute=args.tpm / workers,
+                          max_concurrency=args.llm_concurrency)
+    client = RateLimitedClient(bedrock, limiter) if args.rps else bedrock
+    clients.override('anthropic', client)
+    return bedrock, client
+
+def run_bulk(args) -> dict:
+    """ Screens the entities through BulkScreening, whose forked workers install the stand-ins
+    """
+    import BulkScreening
+
+    entities = entity_names(args.entities)
+    server = CorpusServer(Corpus(pages_per_entity=args.pages_per_entity, paragraphs=args.paragraphs), latency=args.fetch_latency,
+                          exponential=args.exponential_latency)
+    server.start()
+    input_path = os.path.join(BENCHMARK_DIR, 'entities.csv')
+    output_path = os.path.join(BENCHMARK_DIR, 'results.jsonl')
+    with open(input_path, 'w', encoding='utf-8') as f:
+        f.write('entity_name\n' + ''.join(f"{entity}\n" for entity in entities))
+    try:
+        summary = BulkScreening.screen_file(input_path, output_path, workers=args.workers, concurrency=args.concurrency,
+                                            rps=args.rps, tpm=args.tpm, start_method='fork', initializer=install_fakes,
+                                            initargs=(args, server.base_url, entities, args.workers))
+    finally:
+        server.stop()
+    with open(output_path, encoding='utf-8') as f:
+        results = [json.loads(line) for line in f]
+    latencies = [result['seconds'] for result in results if result['error'] is None]
+    errors = [f"{result['entity_name']}: {result['error']}" for result in results if result['error'] is not None]
+    return {
+        'target': args.target,
+        'workers': args.workers,
+        'entities': len(entities),
+        'concurrency': args.concurrency,
+        'errors': len(errors),
+        'partial_reports': summary['partial'],
+        'elapsed_s': summary['elapsed_s'],
+        'throughput_requests_per_s': summary['entities_per_s'],
+        'latency_p50_s': round(percentile(latencies, 0.50), 3),
+        'latency_p95_s': round(percentile(latencies, 0.95), 3),
+        'latency_p99_s': round(percentile(latencies, 0.99), 3),
+        'error_samples': errors[:5],
+    }
+
+async def run(args) -> dict:
+    import ReportGenerator
+    import SearchBackends
+    import APIdocumentprocessor
+
+    entities = entity_names(args.entities)
+    corpus = Corpus(pages_per_entity=args.pages_per_entity, paragraphs=args.paragraphs)
+    server = CorpusServer(corpus, latency=args.fetch_latency,
+                          exponential=args.exponential_latency)
+    server.start()
+    bedrock, client = install_fakes(args, server.base_url, entities)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, errors, partial = [], [], []
+    key_words = 'fraud, corruption'
+    batch = {}
+
+    if args.summary_batch:
+        import SummaryBatch
+        # the offline job runs before the screenings, which then find the summaries in the cache
+        state_path = os.path.join(BENCHMARK_DIR, 'summary_batch.json')
+        batch = await SummaryBatch.submit(entities, key_words, bedrock, state_path)
+        if batch['batch_id'] is not None:
+            batch.update(await SummaryBatch.collect(state_path, bedrock, poll_interval=0.1))
+
+    if args.target == 'api':
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=APIdocumentprocessor.app), base_url='http://benchmark', timeout=None)
+
+    async def screen(entity):
+        async with semaphore:
+            current_entity.set(entity)
+            start = time.perf_counter()
+            try:
+                if args.target == 'api':
+                    response = await http.post('/process', json={'entity_name': entity})
+                    response.raise_for_status()
+                    report = response.json()['summary']
+                else:
+                    report, _ = await screen_with_processor(entity, client, key_words)
+                latencies.append(time.perf_counter() - start)
+                if ReportGenerator.is_partial_report(report):
+                    partial.append(entity)
+            except Exception as e:
+                errors.append(f"{entity}: {e!r}")
+
+    start = time.perf_counter()
+    # every entity is submitted `duplicates` times in a row, like analysts screening the same name in the news
+    await asyncio.gather(*[screen(entity) for entity in entities for _ in range(args.duplicates)])
+    elapsed = time.perf_counter() - start
+
+    if args.target == 'api':
+        await http.aclose()
+    await ReportGenerator.web_fetcher.close()
+    server.stop()
+
+    screened = max(1, len(entities))
+    per_entity = list(bedrock.stats.per_entity.values())
+    return {
+        'target': args.target,
+        'entities': len(entities),
+        'requests': len(entities) * args.duplicates,
+        'concurrency': args.concurrency,
+        'errors': len(errors),
+        'partial_reports': len(partial),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_requests_per_s': round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        'latency_p50_s': round(percentile(latencies, 0.50), 3),
+        'latency_p95_s': round(percentile(latencies, 0.95), 3),
+        'latency_p99_s': round(percentile(latencies, 0.99), 3),
+        'search_calls': SearchBackends.AsyncDDGS.calls,
+        'llm_calls': bedrock.stats.calls,
+        'llm_throttled': bedrock.stats.throttled,
+        'llm_calls_per_entity': round(bedrock.stats.calls / screened, 2),
+        'input_tokens_per_entity': round(sum(s['input_tokens'] for s in per_entity) / screened, 1),
+        'output_tokens_per_entity': round(sum(s['output_tokens'] for s in per_entity) / screened, 1),
+        'batch_requests': bedrock.stats.batch_requests,
+        'batch_summaries_stored': batch.get('stored', 0),
+        'batch_input_tokens_per_entity': round(bedrock.stats.batch_input_tokens / screened, 1),
+        'error_samples': errors[:5],
+    }
+
+def measure_import(module: str = 'APIdocumentprocessor', repeat: int = 3) -> float:
+    """ Returns the best wall time, over `repeat` fresh interpreters, of importing a module of the pipeline
+    """
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=os.environ.copy(), capture_output=True, text=True, check=True)
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return min(timings)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the KYC screening pipeline.")
+    parser.add_argument('--target', choices=['processor', 'api', 'bulk'], default='processor',
+                        help="drive DocumentProcessor directly, the FastAPI /process endpoint or the BulkScreening workers")
+    parser.add_argument('--workers', type=int, default=2, help="number of BulkScreening worker processes of the bulk target")
+    parser.add_argument('--entities', type=int, default=30, help="number of synthetic entities to screen")
+    parser.add_argument('--concurrency', type=int, default=10, help="number of screenings running at the same time")
+    parser.add_argument('--duplicates', type=int, default=1, help="number of concurrent requests for every entity")
+    parser.add_argument('--pages-per-entity', type=int, default=6, help="number of articles of each entity in the corpus")
+    parser.add_argument('--paragraphs', type=int, default=8, help="number of paragraphs of every article")
+    parser.add_argument('--search-latency', type=float, default=0.3, help="seconds per fake DuckDuckGo query")
+    parser.add_argument('--fetch-latency', type=float, default=0.1, help="seconds per page served by the local web server")
+    parser.add_argument('--exponential-latency', action='store_true',
+                        help="draw every search and fetch latency from an exponential distribution of the given mean")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="seconds before the first token of a fake Bedrock call")
+    parser.add_argument('--llm-tokens-per-second', type=float, default=200, help="generation speed of the fake Bedrock model")
+    parser.add_argument('--llm-slow-rate', type=float, default=0.0, help="probability that a fake Bedrock call stalls")
+    parser.add_argument('--llm-slow-latency', type=float, default=10.0, help="extra seconds of a stalled fake Bedrock call")
+    parser.add_argument('--llm-output-tokens', type=int, default=200, help="output tokens of every fake Bedrock answer")
+    parser.add_argument('--throttle-above', type=int, default=0, help="throttle fake Bedrock calls beyond this many in flight (0: never)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="probability that a fake Bedrock call is throttled")
+    parser.add_argument('--rps', type=float, default=20, help="requests per second of the rate limiter wrapping the fake client (0: no limiter)")
+    parser.add_argument('--tpm', type=float, default=2_000_000, help="tokens per minute of the rate limiter")
+    parser.add_argument('--llm-concurrency', type=int, default=32, help="maximum concurrency of the rate limiter")
+    parser.add_argument('--budget', type=float, default=120, help="latency budget of a screening in seconds (0: no limit)")
+    parser.add_argument('--llm-call-timeout', type=float, default=60, help="deadline of every LLM call in seconds")
+    parser.add_argument('--hedge-percentile', type=float, default=0.0, help="hedge LLM calls slower than this percentile (0: never)")
+    parser.add_argument('--pack-tokens', type=int, default=4000,
+                        help="input tokens of the documents packed into one summarize request (0: one request per document)")
+    parser.add_argument('--summary-batch', action='store_true',
+                        help="summarize the documents through a SummaryBatch job before the screenings (processor and api targets)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--import-budget', type=float, default=None, metavar='SECONDS',
+                        help="only measure the import time of the API module and fail when it exceeds SECONDS")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.import_budget is not None:
+        try:
+            elapsed = measure_import()
+        finally:
+            shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
+        print(f"import APIdocumentprocessor: {elapsed:.3f}s (budget {args.import_budget:.3f}s)")
+        return 1 if elapsed > args.import_budget else 0
+    # read by ReportGenerator when run() imports it
+    os.environ['latency_budget_seconds'] = str(args.budget)
+    os.environ['llm_call_timeout'] = str(args.llm_call_timeout)
+    os.environ['llm_hedge_percentile'] = str(args.hedge_percentile)
+    os.environ['summary_pack_tokens'] = str(args.pack_tokens)
+    try:
+        results = run_bulk(args) if args.target == 'bulk' else asyncio.run(run(args))
+    finally:
+        shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>28}: {value}")
+    return 1 if results['errors'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""Bulk screening of a portfolio from the command line.
+
+Entities are streamed from a CSV file (column entity_name, or the first column) or a JSONL file (key entity_name),
+screened by worker processes that each run several screenings at once, and every result is appended to the output,
+JSONL or CSV when its name ends with .csv, as soon as it is known. The normalized name of every entity screened
+completely is appended to a checkpoint file, so that a run started again after a crash or an interruption skips it.
+
+    python BulkScreening.py portfolio.csv results.jsonl --workers 4 --concurrency 8
+    python BulkScreening.py portfolio.jsonl results.csv --checkpoint review.checkpoint --rps 20
+
+Failed and partial screenings are written but not checkpointed, so a resumed run screens them again and appends a
+second row: readers keep the last row of every entity.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import queue
+import signal
+import asyncio
+import logging
+import argparse
+import functools
+import threading
+import multiprocessing
+from typing import Callable, Iterator, Optional
+from TextUtils import normalize_entity
+from Clients import clients, create_anthropic, BEDROCK_RPS, BEDROCK_TPM
+
+BULK_WORKERS = int(os.getenv('bulk_workers', '4'))
+BULK_CONCURRENCY = int(os.getenv('bulk_concurrency', '8'))
+BULK_KEY_WORDS = os.getenv('bulk_key_words', 'fraud, corruption')
+# spawn starts clean interpreters; fork lets a caller patch the pipeline before the workers start, as the benchmark does
+BULK_START_METHOD = os.getenv('bulk_start_method', 'spawn')
+OUTPUT_FIELDS = ['entity_name', 'class', 'partial', 'summary', 'error', 'seconds']
+
+def read_entities(path: str) -> Iterator[str]:
+    """ Yields the entity names of a CSV or JSONL file one by one, without loading the file
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    name = record.get('entity_name', '') if isinstance(record, dict) else str(record)
+                    if name.strip():
+                        yield name.strip()
+            return
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        if 'entity_name' in header:
+            column = header.index('entity_name')
+        else:
+            # no header, the first row is an entity
+            column = 0
+            if header and header[0].strip():
+                yield header[0].strip()
+        for row in reader:
+            if len(row) > column and row[column].strip():
+                yield row[column].strip()
+
+class Checkpoint:
+    """Append-only file of the normalized names of the entities already screened, synced after every entity."""
+    def __init__(self, path: str):
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, entity: str) -> bool:
+        return normalize_entity(entity) in self.done
+
+    def add(self, entity: str):
+        key = normalize_entity(entity)
+        self.done.add(key)
+        self.file.write(key + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+class ResultWriter:
+    """Appends results to a JSONL file, or to a CSV file whose header is written once."""
+    def __init__(self, path: str):
+        self.is_csv = path.lower().endswith('.csv')
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', encoding='utf-8', newline='')
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=OUTPUT_FIELDS)
+            if is_new:
+                self.writer.writeheader()
+
+    def write(self, result: dict):
+        if self.is_csv:
+            self.writer.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+async def serve(tasks, results, concurrency: int, key_words: str):
+    """ Screens the entities of the task queue of a worker process, `concurrency` at a time, until it receives None
+        Args:
+    tasks (multiprocessing.Queue): Entity names, then None once per worker.
+    results (multiprocessing.Queue): Receives a result dict per entity.
+    concurrency (int): The number of screenings running at once in the process.
+    key_words (str): The risk key words of the screenings.
+    """
+    from ReportGenerator import screen_entity, web_fetcher, is_partial_report
+    client = clients.anthropic()
+    # a single thread waits on the process queue, the screenings wait on a local queue
+    local = asyncio.Queue(maxsize=concurrency)
+
+    async def feed():
+        while (entity := await asyncio.to_thread(tasks.get)) is not None:
+            await local.put(entity)
+        for _ in range(concurrency):
+            await local.put(None)
+
+    async def screen():
+        while (entity := await local.get()) is not None:
+            start = time.monotonic()
+            result = {'entity_name': entity, 'class': None, 'partial': False, 'summary': None, 'error': None}
+            try:
+                report, risk_class = await screen_entity(entity, client, key_words)
+                result.update({'class': risk_class, 'partial': is_partial_report(report), 'summary': report})
+            except Exception as e:
+                logging.error(f"Screening of {entity} failed: {e!r}")
+                result['error'] = repr(e)
+            result['seconds'] = round(time.monotonic() - start, 3)
+            results.put(result)
+
+    try:
+        await asyncio.gather(feed(), *[screen() for _ in range(concurrency)])
+    finally:
+        await clients.aclose()
+        await web_fetcher.close()
+
+def worker_main(tasks, results, concurrency: int, key_words: str, rps: float, tpm: float,
+                initializer: Optional[Callable] = None, initargs: tuple = ()):
+    """ Entry point of a worker process, which puts None in the result queue when it stops
+    """
+    # interruptions are handled by the parent, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # every process has its own rate limiter, with its share of the quota of the run; Clients read the environment at
+    # import, before the process started, so the share is given to the factory
+    clients.register('anthropic', functools.partial(create_anthropic, rps=rps, tpm=tpm))
+    try:
+        if initializer is not None:
+            initializer(*initargs)
+        asyncio.run(serve(tasks, results, concurrency, key_words))
+    finally:
+        results.put(None)
+
+def screen_file(input_path: str, output_path: str, checkpoint_path: Optional[str] = None, workers: int = BULK_WORKERS,
+                concurrency: int = BULK_CONCURRENCY, key_words: str = BULK_KEY_WORDS, rps: float = BEDROCK_RPS,
+                tpm: float = BEDROCK_TPM, start_method: str = BULK_START_METHOD, initializer: Optional[Callable] = None,
+                initargs: tuple = ()) -> dict:
+    """
+    Screens every entity of an input file that is not in the checkpoint, appending the results to the output file.
+
+    Args:
+        input_path (str): The CSV or JSONL file of entity names.
+        output_path (str): The JSONL or CSV file the results are appended to.
+        checkpoint_path (str): The checkpoint file, the output path followed by .checkpoint by default.
+        workers (int): The number of worker processes.
+        concurrency (int): The number of screenings running at once in every worker.
+        key_words (str): The risk key words of the screenings.
+        rps (float): The Bedrock requests per second of the whole run, shared by the workers.
+        tpm (float): The Bedrock tokens per minute of the whole run, shared by the workers.
+        start_method (str): The multiprocessing start method of the workers.
+        initializer (Callable): Called with initargs in every worker before its first screening.
+
+    Returns:
+        dict: The counts of screened, failed, partial and skipped entities, the elapsed seconds and the throughput.
+    """
+    checkpoint = Checkpoint(checkpoint_path or output_path + '.checkpoint')
+    writer = ResultWriter(output_path)
+    context = multiprocessing.get_context(start_method)
+    # at most two rounds of work wait in the queue, so the memory does not grow with the input
+    tasks = context.Queue(maxsize=2 * workers * concurrency)
+    results = context.Queue()
+    stop = threading.Event()
+    counts = {'screened': 0, 'failed': 0, 'partial': 0, 'skipped': 0}
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                tasks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def feed():
+        try:
+            for entity in read_entities(input_path):
+                if entity in checkpoint:
+                    counts['skipped'] += 1
+                elif not put(entity):
+                    return
+        except Exception as e:
+            logging.error(f"Reading {input_path} failed: {e!r}")
+        finally:
+            for _ in range(workers):
+                put(None)
+
+    processes = [context.Process(target=worker_main, args=(tasks, results, concurrency, key_words, rps / workers, tpm / workers,
+                                                           initializer, initargs), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    start = time.monotonic()
+    stopped = 0
+    interrupted = False
+    try:
+        while stopped < workers:
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    logging.error("Every worker stopped before the end of the input")
+                    break
+                continue
+            if result is None:
+                stopped += 1
+                continue
+            writer.write(result)
+            if result['error'] is not None:
+                counts['failed'] += 1
+            elif result['partial']:
+                counts['partial'] += 1
+            else:
+                counts['screened'] += 1
+                checkpoint.add(result['entity_name'])
+            done = counts['screened'] + counts['failed'] + counts['partial']
+            if done % 100 == 0:
+                logging.info(f"{done} entities screened in {time.monotonic() - start:.0f}s, {counts['failed']} failed")
+    except KeyboardInterrupt:
+        logging.warning(f"Interrupted, run the same command again to resume from {checkpoint.file.name}")
+        interrupted = True
+    finally:
+        stop.set()
+        for process in processes:
+            # the screenings in flight are lost, their entities are not in the checkpoint
+            process.join(timeout=0 if interrupted else 5)
+            if process.is_alive():
+                process.terminate()
+        writer.close()
+        checkpoint.close()
+    elapsed = time.monotonic() - start
+    done = counts['screened'] + counts['failed'] + counts['partial']
+    return {**counts, 'elapsed_s': round(elapsed, 3), 'entities_per_s': round(done / elapsed, 3) if elapsed else 0.0}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Screens a portfolio of entities offline, resuming from a checkpoint.")
+    parser.add_argument('input', help="CSV (column entity_name or first column) or JSONL (key entity_name) file of entities")
+    parser.add_argument('output', help="JSONL file, or CSV file if its name ends with .csv, the results are appended to")
+    parser.add_argument('--checkpoint', default=None, help="checkpoint file (default: the output path followed by .checkpoint)")
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS, help="number of worker processes")
+    parser.add_argument('--concurrency', type=int, default=BULK_CONCURRENCY, help="number of screenings running at once per worker")
+    parser.add_argument('--key-words', default=BULK_KEY_WORDS, help="risk key words of the screenings")
+    parser.add_argument('--rps', type=float, default=BEDROCK_RPS, help="Bedrock requests per second of the whole run")
+    parser.add_argument('--tpm', type=float, default=BEDROCK_TPM, help="Bedrock tokens per minute of the whole run")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    summary = screen_file(args.input, args.output, checkpoint_path=args.checkpoint, workers=args.workers,
+                          concurrency=args.concurrency, key_words=args.key_words, rps=args.rps, tpm=args.tpm)
+    for key, value in summary.items():
+        print(f"{key:>16}: {value}")
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+aws_access_key_id = os.getenv('aws_access_key_id')
+aws_secret_access_key = os.getenv('aws_secret_access_key')
+aws_session_token = os.getenv('aws_session_token')
+BEDROCK_RPS = float(os.getenv('bedrock_rps', '5'))
+BEDROCK_TPM = float(os.getenv('bedrock_tpm', '200000'))
+BEDROCK_MAX_CONCURRENCY = int(os.getenv('bedrock_max_concurrency', '16'))
+
+def create_anthropic(rps: float = BEDROCK_RPS, tpm: float = BEDROCK_TPM):
+    from anthropic import AsyncAnthropicBedrock
+    from RateLimiter import RateLimiter, RateLimitedClient
+    # retries are done by the rate limiter, which also slows down every other caller when Bedrock throttles
+    limiter = RateLimiter(requests_per_second=rps, tokens_per_minute=tpm, max_concurrency=BEDROCK_MAX_CONCURRENCY)
+    return RateLimitedClient(AsyncAnthropicBedrock(
+        aws_access_key=aws_access_key_id,
+        aws_secret_key=aws_secret_access_key,
+        aws_session_token=aws_session_token,
+        aws_region="us-east-1",
+        max_retries=0
+    ), limiter)
+
+def create_anthropic_api():
+    from anthropic import AsyncAnthropic
+    # the Message Batches API of SummaryBatch, which Bedrock does not offer
+    return AsyncAnthropic(api_key=os.getenv('anthropic_api_key'))
+
+def create_bedrock():
+    import boto3
+    return boto3.client(service_name='bedrock-runtime',
+                        region_name='eu-central-1',
+                        aws_access_key_id=aws_access_key_id,
+                        aws_secret_access_key=aws_secret_access_key,
+                        aws_session_token=aws_session_token)
+
+def create_llm():
+    from langchain_community.llms.bedrock import Bedrock
+    return Bedrock(client=clients.bedrock(), model_id="anthropic.claude-instant-v1")
+
+class ClientRegistry:
+    """Clients of the process, and the stores registered by the modules using them, each created on first use and then
+    shared by every module.
+
+    The API creates them in its lifespan and closes them at shutdown, scripts get them lazily on first call. Nothing is
+    built, none of the heavy SDKs is imported and no cache file is opened when a module is imported.
+    """
+    def __init__(self):
+        self.factories = {'anthropic': create_anthropic, 'anthropic_api': create_anthropic_api, 'bedrock': create_bedrock, 'llm': create_llm}
+        self.instances = {}
+
+    def get(self, name: str):
+        if name not in self.instances:
+            self.instances[name] = self.factories[name]()
+        return self.instances[name]
+
+    def anthropic(self):
+        """The rate-limited AsyncAnthropicBedrock client used by DocumentProcessor."""
+        return self.get('anthropic')
+
+    def anthropic_api(self):
+        """The AsyncAnthropic client of the Anthropic API, used for batch jobs."""
+        return self.get('anthropic_api')
+
+    def bedrock(self):
+        """The boto3 bedrock-runtime client."""
+        return self.get('bedrock')
+
+    def llm(self):
+        """The LangChain Bedrock LLM over the boto3 client."""
+        return self.get('llm')
+
+    def register(self, name: str, factory):
+        """Replaces the factory of a client, which takes effect if the client was not created yet."""
+        self.factories[name] = factory
+
+    def override(self, name: str, instance):
+        """Replaces a client, for instance by a local stand-in in the benchmark."""
+        self.instances[name] = instance
+
+    async def aclose(self):
+        for name in ('anthropic', 'anthropic_api'):
+            close = getattr(self.instances.pop(name, None), 'close', None)
+            if close is not None:
+                await close()
+        self.instances.clear()
+
+clients = ClientRegistry()
@@ -0,0 +1,109 @@
+import random
+import hashlib
+from typing import List
+from langchain_core.documents import Document
+from TextUtils import normalize_entity
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+
+_random = random.Random(20240514)
+PERMUTATIONS = [(_random.randrange(1, MERSENNE_PRIME), _random.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """ Returns the hashed word shingles of a text
+        Args:
+    text (str): The text of a document.
+    size (int): The number of consecutive words of a shingle.
+
+        Returns:
+    set: The 64-bit hashes of every sequence of `size` normalized words.
+    """
+    tokens = normalize_entity(text).split()
+    if len(tokens) < size:
+        tokens = [' '.join(tokens)]
+        size = 1
+    return {int.from_bytes(hashlib.blake2b(' '.join(tokens[i:i + size]).encode('utf-8'), digest_size=8).digest(), 'big')
+            for i in range(len(tokens) - size + 1)}
+
+def minhash(hashes: set) -> List[int]:
+    """ Returns the MinHash signature of a set of shingle hashes, the fraction of equal values of two signatures estimates their Jaccard similarity
+    """
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+def similarity(signature_a: List[int], signature_b: List[int]) -> float:
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / NUM_PERMUTATIONS
+
+def deduplicate(documents: List[Document], threshold: float = 0.8) -> List[Document]:
+    """ Keeps one document per cluster of near-duplicate documents, such as a wire story syndicated by several outlets
+        Args:
+    documents (List[Document]): The loaded documents.
+    threshold (float): The estimated Jaccard similarity of the word shingles above which two documents are duplicates.
+
+        Returns:
+    List[Document]: The longest document of every cluster, in input order, whose metadata "sources" lists the URLs of the whole cluster.
+    """
+    signatures = [minhash(shingles(document.page_content)) for document in documents]
+
+    # locality-sensitive hashing: only documents sharing a whole band of their signature are compared
+    buckets = {}
+    for i, signature in enumerate(signatures):
+        for band in range(BANDS):
+            buckets.setdefault((band, tuple(signature[band * ROWS:(band + 1) * ROWS])), []).append(i)
+
+    parents = list(range(len(documents)))
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for members in buckets.values():
+        for n, i in enumerate(members):
+            for j in members[n + 1:]:
+                if find(i) != find(j) and similarity(signatures[i], signatures[j]) >= threshold:
+                    parents[find(j)] = find(i)
+
+    clusters = {}
+    for i in range(len(documents)):
+        clusters.setdefault(find(i), []).append(i)
+
+    representatives = []
+    for members in clusters.values():
+        best = max(members, key=lambda i: len(documents[i].page_content))
+        sources = []
+        for i in members:
+            for source in documents[i].metadata.get('sources', [documents[i].metadata.get('source', '')]):
+                if source and source not in sources:
+                    sources.append(source)
+        representatives.append((min(members), Document(page_content=documents[best].page_content,
+                                                       metadata={**documents[best].metadata, 'sources': sources})))
+    return [document for _, document in sorted(representatives, key=lambda item: item[0])]
+
+class DuplicateFilter:
+    """Incremental deduplicate for documents arriving one by one: a document is kept unless it is a near duplicate of a
+    document kept before, the first of its cluster, whose "sources" then receive its URLs."""
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+        self.buckets = {}
+        self.kept = []
+
+    def add(self, document: Document) -> bool:
+        """ Returns whether the document is new, indexing it if so
+        """
+        signature = minhash(shingles(document.page_content))
+        keys = [(band, tuple(signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+        sources = [source for source in document.metadata.get('sources', [document.metadata.get('source', '')]) if source]
+        for i in sorted({i for key in keys for i in self.buckets.get(key, ())}):
+            kept_signature, kept = self.kept[i]
+            if similarity(signature, kept_signature) >= self.threshold:
+                kept.metadata['sources'] += [source for source in sources if source not in kept.metadata['sources']]
+                return False
+        document.metadata['sources'] = sources
+        for key in keys:
+            self.buckets.setdefault(key, []).append(len(self.kept))
+        self.kept.append((signature, document))
+        return True
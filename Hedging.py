@@ -0,0 +1,68 @@
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Optional
+from Metrics import HEDGES
+
+class LatencyTracker:
+    """Sliding window of the latencies of one kind of call, whose percentiles set the hedging delay."""
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """ Returns the latency below which `fraction` of the recent calls finished, or None until there are enough of them
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def hedged_call(call: Callable[[], Awaitable], name: str, tracker: LatencyTracker, timeout: Optional[float],
+                      hedge_after: Optional[float] = None):
+    """ Awaits a call within a deadline, sending one duplicate of it when it is slower than `hedge_after`
+        Args:
+    call (Callable): Starts the request, called again for the duplicate.
+    name (str): The kind of call, used as metric label.
+    tracker (LatencyTracker): Receives the latency of the call.
+    timeout (float): The deadline of the call and its duplicate, in seconds from now, None for no deadline.
+    hedge_after (float): The delay after which the duplicate is sent, usually a high percentile of the tracker, None to never hedge.
+
+        Returns:
+    The result of the first request that succeeds; the other one is cancelled.
+
+        Raises:
+    asyncio.TimeoutError: No request succeeded before the deadline.
+    """
+    start = time.monotonic()
+    deadline = start + timeout if timeout is not None else None
+    primary = asyncio.ensure_future(call())
+    tasks = [primary]
+    hedged = False
+    try:
+        if hedge_after is not None and (deadline is None or start + hedge_after < deadline):
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                tasks.append(asyncio.ensure_future(call()))
+                hedged = True
+        error = None
+        while tasks:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError(f"{name} call did not finish within {timeout:.1f}s")
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    tracker.observe(time.monotonic() - start)
+                    if hedged:
+                        HEDGES.labels(name, 'primary' if task is primary else 'hedge').inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
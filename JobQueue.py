@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import asyncio
+import threading
+from typing import Optional
+from ReportGenerator import DocumentProcessor
+from Clients import clients
+
+class JobStore:
+    """SQLite store of the report jobs, so that queued and running jobs survive a restart of the API."""
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY, entity_name TEXT, key_words TEXT, status TEXT,
+            result TEXT, error TEXT, created_at REAL, updated_at REAL)""")
+        self.db.commit()
+
+    def create(self, entity_name: str, key_words: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT INTO jobs VALUES (?, ?, ?, 'queued', ?, NULL, ?, ?)",
+                            (job_id, entity_name, key_words, json.dumps({}), now, now))
+            self.db.commit()
+        return job_id
+
+    def update(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET status = ?, result = COALESCE(?, result), error = ?, updated_at = ? WHERE job_id = ?",
+                            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+            self.db.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.db.execute("SELECT job_id, entity_name, key_words, status, result, error, created_at, updated_at FROM jobs WHERE job_id = ?",
+                                  (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ('job_id', 'entity_name', 'key_words', 'status', 'result', 'error', 'created_at', 'updated_at')
+        job = dict(zip(keys, row))
+        job['result'] = json.loads(job['result'])
+        return job
+
+    def unfinished(self) -> list:
+        with self.lock:
+            rows = self.db.execute("SELECT job_id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at").fetchall()
+        return [row[0] for row in rows]
+
+class JobQueue:
+    """Pool of in-process asyncio workers running the report jobs of a JobStore.
+
+    Each worker runs DocumentProcessor.stream_documents and writes the URLs and summaries to the store as they
+    are produced, so that a poller sees partial results before the report is ready.
+    """
+    def __init__(self, store: JobStore, workers: int, client=None):
+        self.store = store
+        self.client = client
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.tasks = []
+
+    async def start(self):
+        # jobs interrupted by a restart are run again from the start
+        for job_id in self.store.unfinished():
+            self.store.update(job_id, status='queued')
+            self.queue.put_nowait(job_id)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, entity_name: str, key_words: str) -> str:
+        job_id = self.store.create(entity_name, key_words)
+        self.queue.put_nowait(job_id)
+        return job_id
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logging.error(f"Job {job_id} failed: {e}")
+                self.store.update(job_id, status='failed', error=str(e))
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = self.store.get(job_id)
+        processor = DocumentProcessor(entity=job['entity_name'], client=self.client or clients.anthropic(), key_words=job['key_words'])
+        result = {'urls': [], 'summaries': []}
+        self.store.update(job_id, status='running', result=result)
+        async for event, data in processor.stream_documents():
+            if event == 'urls':
+                result['urls'] = data['urls']
+            elif event == 'sanctions':
+                result['sanctions'] = data['match']
+            elif event == 'summary':
+                result['summaries'].append(data)
+            elif event == 'report':
+                result.update(data)
+                self.store.update(job_id, status='done', result=result)
+                return
+            else:
+                continue
+            self.store.update(job_id, status='running', result=result)
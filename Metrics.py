@@ -0,0 +1,66 @@
+import time
+import logging
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+try:
+    from opentelemetry import trace
+    tracer = trace.get_tracer("kyc-pipeline")
+except ImportError:
+    tracer = None
+
+STAGE_SECONDS = Histogram('kyc_stage_seconds', 'Duration of the stages of the KYC pipeline', ['stage'],
+                          buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120))
+STAGE_ITEMS = Histogram('kyc_stage_items', 'Number of queries, pages or documents handled by a stage', ['stage', 'item'],
+                        buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+LLM_TOKENS = Counter('kyc_llm_tokens_total', 'Tokens reported by the Anthropic responses', ['call', 'direction'])
+FETCH_BYTES = Histogram('kyc_fetch_bytes', 'Bytes downloaded per page', buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2e6, 5e6))
+FETCHES = Counter('kyc_fetches_total', 'Page loads by outcome', ['outcome'])
+CACHE_LOOKUPS = Counter('kyc_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+SEARCHES = Counter('kyc_search_calls_total', 'Search backend calls by backend and outcome', ['backend', 'outcome'])
+HEDGES = Counter('kyc_llm_hedges_total', 'Hedged LLM calls by the request that answered first', ['call', 'winner'])
+DEADLINES = Counter('kyc_deadline_exceeded_total', 'Stages cut short by the latency budget of a screening', ['stage'])
+
+@contextmanager
+def span(stage: str, **attributes):
+    """ Times a stage of the pipeline, as an OpenTelemetry span when the API is installed and in the kyc_stage_seconds histogram
+        Args:
+    stage (str): The name of the stage, such as "search", "fetch", "summarize" or "report".
+    attributes: Tags of the stage, such as the entity. Integer tags are also observed as item counts of the stage.
+
+        Yields:
+    dict: The attributes, to which the caller can add counts known only at the end of the stage.
+    """
+    start = time.perf_counter()
+    otel_span = tracer.start_as_current_span(f"kyc.{stage}") if tracer is not None else None
+    current = otel_span.__enter__() if otel_span is not None else None
+    try:
+        yield attributes
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(duration)
+        for name, value in attributes.items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                STAGE_ITEMS.labels(stage, name).observe(value)
+        if current is not None:
+            for name, value in attributes.items():
+                current.set_attribute(name, value if isinstance(value, (str, int, float, bool)) else str(value))
+            otel_span.__exit__(None, None, None)
+        logging.debug(f"{stage} took {duration:.3f}s {attributes}")
+
+def record_usage(call: str, message):
+    """ Adds the input and output tokens reported by an Anthropic response to the token counters
+    """
+    usage = getattr(message, 'usage', None)
+    if usage is None:
+        return
+    LLM_TOKENS.labels(call, 'input').inc(usage.input_tokens or 0)
+    LLM_TOKENS.labels(call, 'output').inc(usage.output_tokens or 0)
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+def metrics_payload():
+    """ Returns the body and content type of the Prometheus exposition of every metric of the process
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
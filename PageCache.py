@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+from TextUtils import normalize_url
+
+class PageCache:
+    """On-disk cache of the text extracted from web pages.
+
+    Texts are stored once per content hash under `directory/blobs`, and a SQLite index maps every normalized URL
+    to its text, its metadata and the ETag/Last-Modified validators sent by the server. Entries older than `ttl`
+    seconds are revalidated with a conditional request, and the least recently used pages are evicted once the
+    stored texts exceed `max_bytes`.
+    """
+    def __init__(self, directory: str, ttl: float = 86400, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url_key TEXT PRIMARY KEY, url TEXT, digest TEXT, metadata TEXT,
+                etag TEXT, last_modified TEXT, fetched_at REAL, accessed_at REAL);
+            CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER);
+            CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at);
+        """)
+        self.db.commit()
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'blobs', digest[:2], digest + '.txt')
+
+    def get(self, url: str) -> Optional[dict]:
+        """
+        Returns the cached entry of an URL, or None if the page was never stored or its text was evicted.
+        The entry holds the text, the metadata, the validators and a `fresh` flag telling whether it is younger than the TTL.
+        """
+        key = normalize_url(url)
+        with self.lock:
+            row = self.db.execute("SELECT digest, metadata, etag, last_modified, fetched_at FROM pages WHERE url_key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            digest, metadata, etag, last_modified, fetched_at = row
+            try:
+                with open(self._blob_path(digest), encoding='utf-8') as f:
+                    text = f.read()
+            except FileNotFoundError:
+                self.db.execute("DELETE FROM pages WHERE url_key = ?", (key,))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE pages SET accessed_at = ? WHERE url_key = ?", (time.time(), key))
+            self.db.commit()
+        return {'text': text, 'metadata': json.loads(metadata), 'etag': etag, 'last_modified': last_modified,
+                'fresh': time.time() - fetched_at < self.ttl}
+
+    def put(self, url: str, text: str, metadata: dict, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """
+        Stores the extracted text of a page and its validators, then evicts the least recently used pages if the cache is over budget.
+        """
+        key = normalize_url(url)
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        now = time.time()
+        with self.lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+            self.db.execute("INSERT OR REPLACE INTO blobs (digest, size) VALUES (?, ?)", (digest, len(data)))
+            old = self.db.execute("SELECT digest FROM pages WHERE url_key = ?", (key,)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (key, url, digest, json.dumps(metadata), etag, last_modified, now, now))
+            if old and old[0] != digest:
+                self._drop_blob_if_unused(old[0])
+            self._evict()
+            self.db.commit()
+
+    def revalidated(self, url: str):
+        """
+        Marks an entry as fresh again after the server answered 304 Not Modified.
+        """
+        with self.lock:
+            self.db.execute("UPDATE pages SET fetched_at = ? WHERE url_key = ?", (time.time(), normalize_url(url)))
+            self.db.commit()
+
+    def _drop_blob_if_unused(self, digest: str):
+        if self.db.execute("SELECT 1 FROM pages WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        self.db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        try:
+            os.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        while total > self.max_bytes:
+            row = self.db.execute("SELECT url_key, digest FROM pages ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            self.db.execute("DELETE FROM pages WHERE url_key = ?", (row[0],))
+            self._drop_blob_if_unused(row[1])
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
@@ -0,0 +1,114 @@
+import re
+from difflib import SequenceMatcher
+from typing import List, Optional
+from langchain_core.documents import Document
+from TextUtils import normalize_entity, estimate_tokens
+
+MAX_PASSAGE_CHARS = 600
+FUZZY_THRESHOLD = 0.85
+
+def split_passages(text: str) -> List[str]:
+    """ Splits the text of a web page into passages
+        Args:
+    text (str): The text extracted from the page.
+
+        Returns:
+    List[str]: The non empty lines of the page, long lines being cut on sentence boundaries into chunks of about MAX_PASSAGE_CHARS characters.
+    """
+    passages = []
+    for line in text.splitlines():
+        line = ' '.join(line.split())
+        if not line:
+            continue
+        if len(line) <= MAX_PASSAGE_CHARS:
+            passages.append(line)
+            continue
+        chunk = ''
+        for sentence in re.split(r"(?<=[.!?])\s+", line):
+            if chunk and len(chunk) + len(sentence) > MAX_PASSAGE_CHARS:
+                passages.append(chunk)
+                chunk = ''
+            chunk = f"{chunk} {sentence}" if chunk else sentence
+        if chunk:
+            passages.append(chunk)
+    return passages
+
+def mentions(passage: str, names: List[List[str]]) -> bool:
+    """ Returns True if a normalized passage mentions one of the names exactly or up to a few typos/transliterations
+        Args:
+    passage (str): The normalized passage.
+    names (List[List[str]]): The normalized entity name and aliases, as lists of tokens.
+
+        Returns:
+    bool: Whether one of the names is found in the passage.
+    """
+    padded = f" {passage} "
+    tokens = passage.split()
+    for name in names:
+        if f" {' '.join(name)} " in padded:
+            return True
+        size = len(name)
+        target = ' '.join(name)
+        for i in range(len(tokens) - size + 1):
+            # cheap prefilter before the edit-distance ratio
+            if tokens[i][0] != name[0][0]:
+                continue
+            if SequenceMatcher(None, ' '.join(tokens[i:i + size]), target).ratio() >= FUZZY_THRESHOLD:
+                return True
+    return False
+
+def extract_passages(document: Document, entity: str, key_words: str, aliases: Optional[List[str]] = None,
+                     token_budget: int = 1500, context: int = 1) -> Optional[Document]:
+    """ Keeps only the passages of a document that are relevant to the screening of an entity
+        Args:
+    document (Document): The loaded web page.
+    entity (str): The screened entity.
+    key_words (str): The comma separated risk key words.
+    aliases (List[str]): Other names of the entity.
+    token_budget (int): The maximum number of tokens kept per document.
+    context (int): The number of neighbouring passages kept around each matching passage.
+
+        Returns:
+    Optional[Document]: A document holding the selected passages in page order, or None when the page never mentions the entity.
+    """
+    names = [normalize_entity(name).split() for name in [entity] + (aliases or [])]
+    names = [name for name in names if name]
+    keywords = [normalize_entity(word) for word in key_words.split(',') if word.strip()]
+
+    passages = split_passages(document.page_content)
+    normalized = [normalize_entity(passage) for passage in passages]
+    entity_hits = [mentions(passage, names) for passage in normalized]
+    if not any(entity_hits):
+        return None
+    keyword_hits = [any(f" {word} " in f" {passage} " for word in keywords) for passage in normalized]
+
+    # passages mentioning both the entity and a risk word come first, then the entity alone, then risk words alone
+    scores = [0] * len(passages)
+    for i, (entity_hit, keyword_hit) in enumerate(zip(entity_hits, keyword_hits)):
+        score = 2 * entity_hit + keyword_hit
+        if score:
+            for j in range(max(0, i - context), min(len(passages), i + context + 1)):
+                scores[j] = max(scores[j], score if j == i else score - 0.5)
+
+    selected = set()
+    budget = token_budget
+    for i in sorted(range(len(passages)), key=lambda i: -scores[i]):
+        if scores[i] <= 0:
+            break
+        cost = estimate_tokens(passages[i])
+        if cost > budget:
+            continue
+        selected.add(i)
+        budget -= cost
+
+    if not selected:
+        return None
+    content = '\n'.join(passages[i] for i in sorted(selected))
+    return Document(page_content=content, metadata=dict(document.metadata))
+
+def extract_documents(documents: List[Document], entity: str, key_words: str, aliases: Optional[List[str]] = None,
+                      token_budget: int = 1500) -> List[Document]:
+    """ Applies extract_passages to every document and drops those without any relevant passage
+    """
+    extracted = [extract_passages(document, entity, key_words, aliases, token_budget) for document in documents]
+    return [document for document in extracted if document is not None]
@@ -0,0 +1,221 @@
+import time
+import random
+import asyncio
+import logging
+from TextUtils import estimate_tokens
+
+THROTTLING_STATUS_CODES = (429, 503, 529)
+
+def is_throttling_error(error: Exception) -> bool:
+    """ Returns True if an error raised by the Anthropic client means that Bedrock throttled or shed the request
+        Args:
+    error (Exception): The exception raised by the client.
+
+        Returns:
+    bool: Whether the request should be retried later at a lower rate.
+    """
+    # duck-typed on anthropic.APIStatusError, so that importing this module does not load the SDK
+    if getattr(error, 'status_code', None) in THROTTLING_STATUS_CODES:
+        return True
+    return 'ThrottlingException' in str(error) or 'Too many requests' in str(error)
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity` tokens.
+    The level may go negative when a request used more than it reserved, later requests then wait for the debt to be repaid."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) / self.rate)
+                self._refill()
+            self.level -= amount
+
+    def adjust(self, amount: float):
+        """Gives back (positive) or takes (negative) tokens once the real cost of a request is known."""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+class AdaptiveConcurrency:
+    """Concurrency limit driven by AIMD: it grows by one slot per window of successful calls and is halved on throttling,
+    once per window: the calls started before the last decrease were sent at the old limit, so their throttles are ignored.
+    `release` is synchronous so that it also runs, without being interrupted, when the holder of a slot is cancelled."""
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.waiters = []
+        self.decreases = 0
+
+    async def acquire(self) -> int:
+        """ Waits for a slot and takes it
+            Returns:
+        int: The number of decreases of the limit so far, to give back to `release`.
+        """
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self.waiters.remove(waiter)
+        self.in_flight += 1
+        return self.decreases
+
+    def release(self, throttled: bool = False, adapt: bool = True, decreases: int = None):
+        """ Gives a slot back, adapting the limit to the outcome of the call unless `adapt` is False (cancelled calls).
+        A throttled call halves the limit only if it started after the last decrease, `decreases` being the value returned by
+        its `acquire` (None: always).
+        """
+        self.in_flight -= 1
+        if throttled:
+            if decreases is None or decreases == self.decreases:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreases += 1
+        elif adapt:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+class RateLimiter:
+    """Process-wide limiter of the Bedrock calls: requests per second, tokens per minute and an adaptive concurrency limit."""
+    def __init__(self, requests_per_second: float, tokens_per_minute: float, max_concurrency: int, max_retries: int = 6,
+                 base_delay: float = 0.5, max_delay: float = 30):
+        self.requests = TokenBucket(rate=requests_per_second, capacity=max(1, requests_per_second))
+        self.tokens = TokenBucket(rate=tokens_per_minute / 60, capacity=tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(initial=max(1, max_concurrency // 2), maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, self.base_delay)
+            except ValueError:
+                pass
+        # full jitter, so that throttled callers do not retry in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def acquire(self, reserved_tokens: int) -> int:
+        """ Takes a concurrency slot, then waits for the request and token buckets, giving the slot back if the wait fails or is cancelled
+            Returns:
+        int: The decreases of the concurrency limit when the slot was taken, to give back to `concurrency.release`.
+        """
+        decreases = await self.concurrency.acquire()
+        try:
+            await self.requests.acquire()
+            await self.tokens.acquire(reserved_tokens)
+        except BaseException:
+            self.concurrency.release(adapt=False)
+            raise
+        return decreases
+
+def reserved_tokens(kwargs: dict) -> int:
+    prompt = ''.join(str(message.get('content', '')) for message in kwargs.get('messages', []))
+    return estimate_tokens(prompt) + kwargs.get('max_tokens', 0)
+
+def used_tokens(message) -> int:
+    usage = getattr(message, 'usage', None)
+    if usage is None:
+        return 0
+    return (usage.input_tokens or 0) + (usage.output_tokens or 0)
+
+class RateLimitedMessages:
+    def __init__(self, messages, limiter: RateLimiter):
+        self.messages = messages
+        self.limiter = limiter
+
+    async def create(self, **kwargs):
+        reserved = reserved_tokens(kwargs)
+        for attempt in range(self.limiter.max_retries + 1):
+            decreases = await self.limiter.acquire(reserved)
+            try:
+                message = await self.messages.create(**kwargs)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.limiter.concurrency.release(throttled=throttled, decreases=decreases)
+                if not throttled or attempt == self.limiter.max_retries:
+                    raise
+                delay = self.limiter.backoff(attempt, e)
+                logging.warning(f"Bedrock throttled the request, retry {attempt + 1}/{self.limiter.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # cancelled by a deadline, a hedge that won or the end of a budget
+                self.limiter.concurrency.release(adapt=False)
+                raise
+            self.limiter.concurrency.release()
+            actual = used_tokens(message)
+            if actual:
+                self.limiter.tokens.adjust(reserved - actual)
+            return message
+
+    def stream(self, **kwargs):
+        return RateLimitedStream(self.messages, self.limiter, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.messages, name)
+
+class RateLimitedStream:
+    """Async context manager wrapping messages.stream: the request is admitted by the limiter and retried on throttling when opened."""
+    def __init__(self, messages, limiter: RateLimiter, kwargs: dict):
+        self.messages = messages
+        self.limiter = limiter
+        self.kwargs = kwargs
+        self.manager = None
+        self.decreases = None
+
+    async def __aenter__(self):
+        reserved = reserved_tokens(self.kwargs)
+        for attempt in range(self.limiter.max_retries + 1):
+            self.decreases = await self.limiter.acquire(reserved)
+            try:
+                self.manager = self.messages.stream(**self.kwargs)
+                return await self.manager.__aenter__()
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.limiter.concurrency.release(throttled=throttled, decreases=self.decreases)
+                if not throttled or attempt == self.limiter.max_retries:
+                    raise
+                await asyncio.sleep(self.limiter.backoff(attempt, e))
+            except BaseException:
+                self.limiter.concurrency.release(adapt=False)
+                raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self.manager.__aexit__(exc_type, exc, tb)
+        finally:
+            cancelled = isinstance(exc, asyncio.CancelledError)
+            self.limiter.concurrency.release(throttled=exc is not None and not cancelled and is_throttling_error(exc), adapt=not cancelled,
+                                             decreases=self.decreases)
+
+class RateLimitedClient:
+    """Wraps an AsyncAnthropicBedrock client so that every messages.create and messages.stream call goes through a shared RateLimiter.
+    Other attributes are those of the wrapped client."""
+    def __init__(self, client, limiter: RateLimiter):
+        self.client = client
+        self.limiter = limiter
+        self.messages = RateLimitedMessages(client.messages, limiter)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
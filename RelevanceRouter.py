@@ -0,0 +1,113 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+from langchain_core.documents import Document
+from PassageExtractor import split_passages, mentions
+from TextUtils import normalize_entity
+
+# terms of adverse media, matched as word prefixes so that "sanction" also matches "sanctions" and "sanctioned"
+ADVERSE_MEDIA_TERMS = ('sanction', 'fraud', 'corrupt', 'brib', 'money launder', 'launder', 'embezzl', 'indict', 'convict',
+                       'fined', 'penalt', 'prosecut', 'investigat', 'charged', 'arrest', 'guilty', 'lawsuit', 'sued',
+                       'settlement', 'misconduct', 'scandal', 'tax evasion', 'evasion', 'terrorist financ', 'smuggl',
+                       'cartel', 'ponzi', 'insider trading', 'market manipulation', 'kickback', 'extortion', 'forfeit',
+                       'blacklist', 'debar', 'illicit', 'criminal', 'seized', 'raid', 'whistleblow', 'misappropriat')
+# official sources and established newsrooms are always summarized, user generated content never is
+ALLOW_DOMAINS = ('reuters.com', 'apnews.com', 'bbc.co.uk', 'bbc.com', 'ft.com', 'bloomberg.com', 'wsj.com', 'occrp.org',
+                 'icij.org', 'justice.gov', 'treasury.gov', 'sec.gov', 'fca.org.uk', 'gov.uk', 'europa.eu', 'admin.ch',
+                 'worldbank.org', 'interpol.int')
+DENY_DOMAINS = ('reddit.com', 'quora.com', 'pinterest.com', 'facebook.com', 'instagram.com', 'tiktok.com', 'twitter.com',
+                'x.com', 'youtube.com', 'linkedin.com', 'glassdoor.com', 'indeed.com', 'trustpilot.com', 'stackexchange.com')
+
+# BM25 parameters; the document length is compared to a fixed average so that a document is scored without the others
+K1 = 1.2
+B = 0.75
+AVERAGE_DOCUMENT_WORDS = 300
+
+@lru_cache(maxsize=256)
+def build_lexicon(key_words: str, extra_terms: Tuple[str, ...] = ()) -> Tuple[re.Pattern, Dict[str, float]]:
+    """ Returns the adverse-media lexicon of a screening
+        Args:
+    key_words (str): The comma separated risk key words of the screening, weighted twice as much as the default terms.
+    extra_terms (Tuple[str]): Terms added to the default ones by the configuration.
+
+        Returns:
+    Tuple[re.Pattern, Dict[str, float]]: A pattern finding every term as a word prefix in a normalized text, and the weight of every term.
+    """
+    weights = {normalize_entity(term): 1.0 for term in ADVERSE_MEDIA_TERMS + tuple(extra_terms)}
+    for word in key_words.split(','):
+        if normalize_entity(word):
+            weights[normalize_entity(word)] = 2.0
+    weights.pop('', None)
+    # the longest terms first so that "money launder" wins over "launder"
+    alternatives = '|'.join(re.escape(term) for term in sorted(weights, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)({alternatives})\w*"), weights
+
+def domain_matches(host: str, domains: Iterable[str]) -> bool:
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+class RelevanceRouter:
+    """Local scoring of the loaded documents that decides which ones are worth an LLM summary.
+
+    A document is scored with BM25 against the adverse-media lexicon seeded from the key words, and with the share of
+    its passages mentioning the entity. Documents of denied domains are dropped and documents of allowed domains are
+    always kept; the others are kept when both scores reach their thresholds. Every document is judged on its own, so
+    documents can be routed as soon as they are loaded.
+    """
+    def __init__(self, threshold: float = 1.0, min_density: float = 0.2, allow_domains: Iterable[str] = ALLOW_DOMAINS,
+                 deny_domains: Iterable[str] = DENY_DOMAINS, extra_terms: Iterable[str] = ()):
+        self.threshold = threshold
+        self.min_density = min_density
+        self.allow_domains = tuple(allow_domains)
+        self.deny_domains = tuple(deny_domains)
+        self.extra_terms = tuple(extra_terms)
+
+    def score(self, document: Document, entity: str, key_words: str, aliases: Optional[List[str]] = None) -> dict:
+        """ Scores a document for the screening of an entity
+            Args:
+        document (Document): The loaded document, reduced to its relevant passages.
+        entity (str): The screened entity.
+        key_words (str): The comma separated risk key words.
+        aliases (List[str]): Other names of the entity.
+
+            Returns:
+        dict: The BM25 "score" of the document against the lexicon, the mention "density" of the entity, the "terms" found and the "domain" verdict (allow, deny or None).
+        """
+        pattern, weights = build_lexicon(key_words, self.extra_terms)
+        text = normalize_entity(document.page_content)
+        length = len(text.split())
+        counts = {}
+        for term in pattern.findall(text):
+            counts[term] = counts.get(term, 0) + 1
+        norm = K1 * (1 - B + B * length / AVERAGE_DOCUMENT_WORDS)
+        score = sum(weights[term] * count * (K1 + 1) / (count + norm) for term, count in counts.items())
+
+        names = [normalize_entity(name).split() for name in [entity] + (aliases or [])]
+        passages = [normalize_entity(passage) for passage in split_passages(document.page_content)]
+        density = sum(mentions(passage, [name for name in names if name]) for passage in passages) / max(1, len(passages))
+
+        hosts = [(urlsplit(source).hostname or '').lower().removeprefix('www.')
+                 for source in document.metadata.get('sources', [document.metadata.get('source', '')])]
+        domain = None
+        if any(domain_matches(host, self.allow_domains) for host in hosts):
+            domain = 'allow'
+        elif hosts and all(domain_matches(host, self.deny_domains) for host in hosts):
+            domain = 'deny'
+        return {'score': round(score, 3), 'density': round(density, 3), 'terms': sorted(counts), 'domain': domain}
+
+    def is_relevant(self, document: Document, entity: str, key_words: str, aliases: Optional[List[str]] = None) -> bool:
+        """ Judges one document, recording its scores in its "relevance" metadata
+        """
+        scores = self.score(document, entity, key_words, aliases)
+        document.metadata['relevance'] = scores
+        if scores['domain'] is not None:
+            return scores['domain'] == 'allow'
+        return scores['score'] >= self.threshold and scores['density'] >= self.min_density
+
+    def route(self, documents: List[Document], entity: str, key_words: str, aliases: Optional[List[str]] = None) -> Tuple[List[Document], List[Document]]:
+        """ Splits documents into those worth summarizing and the others, both in input order
+        """
+        kept, dropped = [], []
+        for document in documents:
+            (kept if self.is_relevant(document, entity, key_words, aliases) else dropped).append(document)
+        return kept, dropped
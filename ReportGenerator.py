@@ -1,65 +1,314 @@
-import nest_asyncio
 import dotenv
 
-from langchain_community.document_loaders import WebBaseLoader
-import boto3
-from langchain_community.llms.bedrock import Bedrock
-from langchain.chains import MapReduceDocumentsChain, ReduceDocumentsChain
-from WebSearcher import DuckDuckGoSearchManager
+from WebSearcher import SearchManager
+from Clients import clients
+from PageCache import PageCache
+from WebFetcher import WebFetcher
+from PassageExtractor import extract_passages
+from Deduplicator import DuplicateFilter
+from RelevanceRouter import RelevanceRouter, ALLOW_DOMAINS, DENY_DOMAINS
+from SanctionsList import SanctionsIndex
+from SummaryCache import InMemorySummaryCache, SQLiteSummaryCache, summary_cache_key
+from ReportStore import ReportStore
+from SingleFlight import SingleFlight
+from Hedging import LatencyTracker, hedged_call
 import logging
 import os
 import time
-from pydantic import BaseModel
-from anthropic import AsyncAnthropicBedrock
+from TextUtils import estimate_tokens, normalize_entity
+from Metrics import span, record_usage, record_cache_lookup, STAGE_SECONDS, DEADLINES
 import asyncio
-nest_asyncio.apply()
+import hashlib
+import re
 dotenv.load_dotenv()
 
 GOOGLE_CSE_ID=os.getenv('google_cse_id')
 GOOGLE_API_KEY=os.getenv('google_api_key')
-aws_access_key_id = os.getenv('aws_access_key_id')
-aws_secret_access_key = os.getenv('aws_secret_access_key')
-aws_session_token = os.getenv('aws_session_token')
+PAGE_CACHE_DIR = os.getenv('page_cache_dir', '.kyc_cache/pages')
+PAGE_CACHE_TTL = float(os.getenv('page_cache_ttl', '86400'))
+PAGE_CACHE_MAX_MB = int(os.getenv('page_cache_max_mb', '256'))
+FETCH_PER_HOST = int(os.getenv('fetch_per_host', '4'))
+FETCH_TIMEOUT = float(os.getenv('fetch_timeout', '20'))
+FETCH_MAX_BYTES = int(os.getenv('fetch_max_bytes', '2000000'))
+PASSAGE_TOKEN_BUDGET = int(os.getenv('passage_token_budget', '1500'))
+DEDUP_THRESHOLD = float(os.getenv('dedup_threshold', '0.8'))
+REPORT_TOKEN_BUDGET = int(os.getenv('report_token_budget', '6000'))
+SUMMARY_CACHE = os.getenv('summary_cache', 'sqlite')
+SUMMARY_CACHE_PATH = os.getenv('summary_cache_path', '.kyc_cache/summaries.sqlite')
+REPORT_STORE = os.getenv('report_store', 'sqlite')
+REPORT_STORE_PATH = os.getenv('report_store_path', '.kyc_cache/reports.sqlite')
+RELEVANCE_THRESHOLD = float(os.getenv('relevance_threshold', '1.0'))
+RELEVANCE_MIN_DENSITY = float(os.getenv('relevance_min_density', '0.2'))
+RELEVANCE_ALLOW_DOMAINS = os.getenv('relevance_allow_domains', ','.join(ALLOW_DOMAINS))
+RELEVANCE_DENY_DOMAINS = os.getenv('relevance_deny_domains', ','.join(DENY_DOMAINS))
+ADVERSE_MEDIA_TERMS = os.getenv('adverse_media_terms', '')
+SCREENING_REUSE_SECONDS = float(os.getenv('screening_reuse_seconds', '30'))
+SANCTIONS_DIR = os.getenv('sanctions_dir', 'sanctions_lists')
+SANCTIONS_MATCH_THRESHOLD = float(os.getenv('sanctions_match_threshold', '0.9'))
+SANCTIONS_REFRESH_SECONDS = float(os.getenv('sanctions_refresh_seconds', '300'))
+# seconds a screening may take, 0 for no limit; the last REPORT_RESERVE seconds, at most half of it, are kept for the report
+LATENCY_BUDGET = float(os.getenv('latency_budget_seconds', '120'))
+REPORT_RESERVE = float(os.getenv('report_reserve_seconds', '25'))
+LLM_CALL_TIMEOUT = float(os.getenv('llm_call_timeout', '60'))
+# a duplicate of an LLM call is sent when it is slower than this percentile of the recent calls, 0 never hedges
+LLM_HEDGE_PERCENTILE = float(os.getenv('llm_hedge_percentile', '0'))
+# workers of the fetch and summary stages of a screening, and size of the queues between the stages
+PIPELINE_FETCH_WORKERS = int(os.getenv('pipeline_fetch_workers', '8'))
+PIPELINE_SUMMARY_WORKERS = int(os.getenv('pipeline_summary_workers', '8'))
+PIPELINE_QUEUE_SIZE = int(os.getenv('pipeline_queue_size', '8'))
+# documents are packed into one summarize request up to this many input tokens, 0 sends one request per document;
+# a pack waits at most SUMMARY_PACK_LINGER seconds for more documents
+SUMMARY_PACK_TOKENS = int(os.getenv('summary_pack_tokens', '4000'))
+SUMMARY_PACK_LINGER = float(os.getenv('summary_pack_linger', '0.3'))
 
-bedrock = boto3.client(service_name='bedrock-runtime',
-region_name='eu-central-1',
-aws_access_key_id=aws_access_key_id,
-aws_secret_access_key=aws_secret_access_key,
-aws_session_token=aws_session_token)
+SUMMARY_MODEL = "anthropic.claude-3-haiku-20240307-v1:0"
+SUMMARY_TEMPLATE = """
+        You are a professional KYC analyst who creates detailed summaries of web articles.
+        
+        Based on this document {document}, list:
+        - All the information linked to sanctions taken against {entity} for illegal facts, fraud, corruption or similar facts.
+        - All controversial facts, fraud, money evasion, illicit activities, and financial crimes {entity} is involved in.
+        
+        Also mention the country where these events are connected to determine if the entity might be linked to activities in countries known for incidents related to fraud, corruption.
+        At the end of each entry, please add the URL of the article."""
+PACKED_SUMMARY_TEMPLATE = """
+        You are a professional KYC analyst who creates detailed summaries of web articles.
+
+        Here are {count} web articles about {entity}, each one between <document> tags with its id and URL:
+        {documents}
+
+        Summarize every article separately. For each article, list:
+        - All the information linked to sanctions taken against {entity} for illegal facts, fraud, corruption or similar facts.
+        - All controversial facts, fraud, money evasion, illicit activities, and financial crimes {entity} is involved in.
+
+        Also mention the country where these events are connected to determine if the entity might be linked to activities in countries known for incidents related to fraud, corruption.
+        At the end of each entry, please add the URL of the article.
+
+        Write the summary of every article between <summary id="..."> and </summary> tags carrying the id of the article, in the order of the articles, and nothing outside these tags."""
+SUMMARY_MAX_TOKENS = 1256
+# any edit of the templates changes their version and invalidates the cached summaries
+SUMMARY_PROMPT_VERSION = hashlib.sha256((SUMMARY_TEMPLATE + PACKED_SUMMARY_TEMPLATE).encode('utf-8')).hexdigest()[:16]
+
+REPORT_MODEL = "anthropic.claude-3-haiku-20240307-v1:0"
+REDUCE_TEMPLATE = """
+        You are a professional KYC analyst who consolidates summaries of web articles.
+
+        Here are summaries of web pages about {entity}:
+        {summaries}
+
+        Merge them into a single summary that keeps every fact about sanctions, fraud, corruption, money evasion, illicit activities and financial crimes involving {entity}, with the countries concerned.
+        Remove repetitions but never drop a fact, and keep after each fact the URL of every article it comes from."""
+REPORT_TEMPLATE = """ You are a professional KYC analyst who generates well-structured analysis reports that are detailed, thorough, in-depth, and complex, while maintaining clarity and conciseness.
+
+        You are a professional KYC analyst who generates well-structured analysis reports that are detailed, thorough, in-depth, and complex, while maintaining clarity and conciseness.
+
+        After conducting a web search, we have these web pages {summaries} containing information extracted from the web. Please generate a very detailed report of:
+        - All sanctions taken against {entity} that could pose a risk for a trading company. And if in you knowledge, you know sanctions taken for illegal facts, you must list some sanctions.
+
+        - All relevant facts extracted and related/done by {entity} that are directly linked to fraud, corruption, illegal activities, etc.
+
+        Use your existing knowledge and expertise to provide context and identify potential risks, making logical connections based on previous KYC analyses.
+
+        If {entity} is not associated with any concerning facts, only return that it does not present a particular risk and do not include summaries of web pages about {entity}.
+
+        Otherwise, return a detailed and well-organized final report that summarizes the information. For each piece of information, you must include the source link (URL) so that the reader can directly access the article.
+
+        Begin the report with the sentence: "The web search report and the risk level:"
+                
+        At the end of the report, also include a sentence justifying the risk level. If there were sanctions, automatically set the risk level to "High."
+        
+        The last line should only contain one of these words describing the risk class: Low, Medium, or High. Do not add the word "Risk."
+        """
+# a stored report is only reused if it was generated with the same prompts and model
+REPORT_PROMPT_VERSION = hashlib.sha256((REDUCE_TEMPLATE + REPORT_TEMPLATE + REPORT_MODEL).encode('utf-8')).hexdigest()[:16]
+
+def create_page_cache():
+    return PageCache(directory=PAGE_CACHE_DIR, ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024)
+
+def create_summary_cache():
+    return SQLiteSummaryCache(SUMMARY_CACHE_PATH) if SUMMARY_CACHE == 'sqlite' else InMemorySummaryCache()
+
+def create_report_store():
+    return ReportStore(REPORT_STORE_PATH) if REPORT_STORE == 'sqlite' else None
+
+# the stores open their SQLite files and directories on first use, not when the API module is imported
+clients.register('page_cache', create_page_cache)
+clients.register('summary_cache', create_summary_cache)
+clients.register('report_store', create_report_store)
+
+web_fetcher = WebFetcher(per_host=FETCH_PER_HOST, total_timeout=FETCH_TIMEOUT, max_bytes=FETCH_MAX_BYTES)
+relevance_router = RelevanceRouter(threshold=RELEVANCE_THRESHOLD, min_density=RELEVANCE_MIN_DENSITY,
+                                   allow_domains=[domain.strip() for domain in RELEVANCE_ALLOW_DOMAINS.split(',') if domain.strip()],
+                                   deny_domains=[domain.strip() for domain in RELEVANCE_DENY_DOMAINS.split(',') if domain.strip()],
+                                   extra_terms=[term.strip() for term in ADVERSE_MEDIA_TERMS.split(',') if term.strip()])
+sanctions_index = SanctionsIndex(SANCTIONS_DIR, threshold=SANCTIONS_MATCH_THRESHOLD, refresh_interval=SANCTIONS_REFRESH_SECONDS)
+# concurrent screenings of the same entity and key words share one pipeline run
+screenings = SingleFlight('screening', reuse_window=SCREENING_REUSE_SECONDS)
+llm_latencies = {'summarize': LatencyTracker(), 'summarize_packed': LatencyTracker(), 'reduce': LatencyTracker(), 'report': LatencyTracker()}
 
-client = AsyncAnthropicBedrock(
-    aws_access_key=aws_access_key_id,
-    aws_secret_key=aws_secret_access_key,
-    aws_session_token=aws_session_token,
-    aws_region="us-east-1"
-)
+PARTIAL_NOTICE = "PARTIAL REPORT: "
 
-llm_claude1 = Bedrock(client=bedrock, model_id="anthropic.claude-instant-v1")
+def format_summaries(summaries) -> str:
+    """
+    Joins summaries into the text inserted in the reduce and report prompts.
+    """
+    return "\n\n---\n\n".join(summaries)
+
+def no_adverse_media_report(entity, read) -> str:
+    """
+    Writes the report of an entity whose pages were read but none of them is relevant enough to be summarized, in the format of the generated reports.
+    """
+    return (f"The web search report and the risk level:\n\n"
+            f"The web search did not find relevant adverse media about {entity}: none of the {read} pages read links {entity} to sanctions, "
+            f"fraud, corruption or financial crimes.\n\n"
+            f"{entity} does not present a particular risk.\n\n"
+            f"Low")
+
+def pack_documents(documents, token_budget):
+    """
+    Groups documents, in order, into packs whose estimated input tokens fit the budget; a document larger than the budget is packed alone.
+    """
+    packs, tokens = [], 0
+    for document in documents:
+        cost = estimate_tokens(document.page_content)
+        if not packs or tokens + cost > token_budget:
+            packs.append([])
+            tokens = 0
+        packs[-1].append(document)
+        tokens += cost
+    return packs
+
+def format_document(document, id=None) -> str:
+    """
+    Writes a document for a summarize prompt: its text and the URLs of its cluster, without the rest of its metadata.
+    """
+    urls = " ".join(document.metadata.get("sources", [document.metadata.get("source", "")]))
+    tag = f'<document id="{id}" url="{urls}">' if id is not None else f'<document url="{urls}">'
+    return f'{tag}\n{document.page_content}\n</document>'
+
+def format_packed_documents(documents) -> str:
+    return "\n\n".join(format_document(document, i) for i, document in enumerate(documents, 1))
+
+def split_packed_summaries(text, count):
+    """
+    Splits the answer to a packed summarize request into the summaries of its documents.
+
+    Returns:
+        List[Optional[str]]: The summary of every document in request order, None for a document without a non-empty summary in the answer.
+    """
+    summaries = [None] * count
+    for match in re.finditer(r'<summary\s+id\s*=\s*"?(\d+)"?\s*>(.*?)</summary>', text, re.DOTALL):
+        index = int(match.group(1)) - 1
+        if 0 <= index < count and summaries[index] is None and match.group(2).strip():
+            summaries[index] = match.group(2).strip()
+    return summaries
+
+def partial_report(report, reason) -> str:
+    """
+    Flags a report generated from part of the documents, keeping the risk class on its last line.
+    """
+    return f"{PARTIAL_NOTICE}{reason}, facts from the other pages may be missing.\n\n{report}"
+
+def is_partial_report(report) -> bool:
+    return report.startswith(PARTIAL_NOTICE)
+
+def not_assessed_report(entity, reason) -> str:
+    """
+    Writes the report of a screening that summarized no document without having read and dropped any page: the search found
+    nothing, no page could be loaded or the latency budget ran out. It is flagged partial and has no risk level, since the
+    pages that were not read may hold adverse media, so the entity is not rated Low.
+    """
+    return (f"{PARTIAL_NOTICE}{reason}, {entity} could not be assessed.\n\n"
+            f"No page about {entity} could be read and judged, so no risk level is given. "
+            f"Screen {entity} again later.")
+
+def sanctions_report(entity, match) -> str:
+    """
+    Writes the report of an entity found on a sanctions list, in the format of the generated reports.
+    """
+    aliases = f" (listed as \"{match['matched_name']}\")" if match['matched_name'] != match['name'] else ""
+    program = f", programme {match['program']}" if match['program'] else ""
+    return (f"The web search report and the risk level:\n\n"
+            f"{entity} matches \"{match['name']}\"{aliases} on the {match['list']} sanctions list "
+            f"(reference {match['reference']}{program}, file {match['file']}, name similarity {match['score']:.2f}).\n\n"
+            f"The entity is subject to sanctions, so the risk level is automatically set to High.\n\n"
+            f"High")
 
 class DocumentProcessor:
-    def __init__(self, entity, client, key_words):
+    def __init__(self, entity, client, key_words, summary_cache=None, aliases=None, fetcher=web_fetcher, sanctions=sanctions_index,
+                 report_store=None, router=relevance_router):
         self.entity = entity
+        self.fetcher = fetcher
+        self.sanctions = sanctions
+        self.aliases = aliases or []
         self.docs = [] 
+        self.urls = []
         self.is_loaded = False 
         self.client = client
         self.key_words=key_words
+        self.summary_cache = summary_cache if summary_cache is not None else clients.get('summary_cache')
+        self.report_store = report_store if report_store is not None else clients.get('report_store')
+        self.router = router
+        self.dropped = []
+        self.loaded = 0
+        self.previous = None
+        self.document_summaries = {}
+        self.deadline = None
+        self.reserve = 0
+        self.partial = None
+
+    def start_budget(self, budget):
+        """
+        Starts the latency budget of the screening, keeping REPORT_RESERVE seconds of it, but at most half, for the report.
+        """
+        self.deadline = time.monotonic() + budget if budget else None
+        self.reserve = min(REPORT_RESERVE, budget / 2) if budget else 0
+
+    def remaining(self, reserve=False):
+        """
+        Returns the seconds left in the latency budget of the screening, less the report reserve if asked, or None without a budget.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic() - (self.reserve if reserve else 0))
+
+    def budget_exceeded(self, stage, reason):
+        logging.warning(f"Latency budget of the screening of {self.entity} exceeded during {stage}: {reason}")
+        DEADLINES.labels(stage).inc()
+        self.partial = reason
+
+    async def create_message(self, call, **request):
+        """
+        Sends a request to the model within LLM_CALL_TIMEOUT and the budget left, with a hedged duplicate when hedging is enabled.
 
-    async def initialize(self):
-        self.search_manager = DuckDuckGoSearchManager(entity_name=self.entity, num_results=2, key_words=self.key_words, llm=llm_claude1)
-        self.results = await self.search_manager.perform_search()
-        print(self.results)
-        self.urls = [result["href"] for result in self.results]
-        self.load_documents()
-        self.is_loaded = True
+        Raises:
+            asyncio.TimeoutError: The model did not answer in time.
+        """
+        tracker = llm_latencies[call]
+        timeout = LLM_CALL_TIMEOUT or None
+        if self.remaining() is not None:
+            timeout = self.remaining() if timeout is None else min(timeout, self.remaining())
+        hedge_after = tracker.percentile(LLM_HEDGE_PERCENTILE) if LLM_HEDGE_PERCENTILE else None
+        try:
+            return await hedged_call(lambda: self.client.messages.create(**request), call, tracker, timeout, hedge_after)
+        except asyncio.TimeoutError:
+            DEADLINES.labels(call).inc()
+            raise
 
-    def load_documents(self):
+    async def screen_sanctions(self):
         """
-        Loads asynchronously multiple documents from specified URLs for processing.
+        Looks the entity and its aliases up in the local sanctions lists, picking up list files added since the last lookup.
+
+        Returns:
+            dict: The best match above the confidence threshold, with its list and reference, or None if the entity is not listed.
         """
-        loader =  WebBaseLoader(self.urls, continue_on_failure=True)
-        loader.requests_per_second = 5
-        docs = loader.aload()
-        self.docs = docs
+        with span('sanctions', entity=self.entity) as attributes:
+            await self.sanctions.arefresh()
+            match = self.sanctions.screen(self.entity, self.aliases)
+            attributes['listed'] = match is not None
+        if match is not None:
+            logging.info(f"{self.entity} matches {match['name']} on {match['list']} ({match['reference']}, score {match['score']})")
+        return match
 
     async def summarize_document(self, document):
         """
@@ -72,101 +321,528 @@ class DocumentProcessor:
             str: The summarized content as generated by the language model, which includes identified risks and their context, formatted along with
                 relevant URL links for easy verification.
         """
+        with span('summarize', entity=self.entity, source=document.metadata.get('source', '')):
+            message = await self.create_message('summarize', **self.summary_request([document]))
+        record_usage('summarize', message)
+        return message.content[0].text
 
+    def summary_request(self, documents) -> dict:
+        """
+        Returns the parameters of the summarize request of one document, or of the packed request of several documents.
+        """
+        if len(documents) == 1:
+            content = SUMMARY_TEMPLATE.format(document=format_document(documents[0]), entity=self.entity)
+            max_tokens = SUMMARY_MAX_TOKENS
+        else:
+            content = PACKED_SUMMARY_TEMPLATE.format(documents=format_packed_documents(documents), count=len(documents), entity=self.entity)
+            # the output limit of the model
+            max_tokens = min(4096, SUMMARY_MAX_TOKENS * len(documents))
+        return {'model': SUMMARY_MODEL, 'max_tokens': max_tokens, 'messages': [{"role": "user", "content": content}]}
 
-        content=f"""
-        You are a professional KYC analyst who creates detailed summaries of web articles.
-        
-        Based on this document {document}, list:
-        - All the information linked to sanctions taken against {self.entity} for illegal facts, fraud, corruption or similar facts.
-        - All controversial facts, fraud, money evasion, illicit activities, and financial crimes {self.entity} is involved in.
-        
-        Also mention the country where these events are connected to determine if the entity might be linked to activities in countries known for incidents related to fraud, corruption.
-        At the end of each entry, please add the URL of the article."""
+    async def summarize_packed(self, documents):
+        """
+        Asynchronously summarizes several documents in a single request, sharing the instructions of the prompt.
+
+        Returns:
+            List[Optional[str]]: The summary of every document, None for those missing from the answer.
+        """
+        with span('summarize_packed', entity=self.entity, documents=len(documents)):
+            message = await self.create_message('summarize_packed', **self.summary_request(documents))
+        record_usage('summarize_packed', message)
+        return split_packed_summaries(message.content[0].text, len(documents))
+
+    async def summarize_pack(self, documents):
+        """
+        Returns the summaries of a pack of documents: from the cache when possible, the others from one packed request when
+        there are several, and alone for the documents missing from its answer.
+
+        Returns:
+            List[Optional[str]]: The summary of every document, None for those whose request timed out.
+        """
+        keys, summaries = map(list, zip(*[self.cached_summary(document) for document in documents]))
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        if len(missing) > 1:
+            try:
+                packed = await self.summarize_packed([documents[i] for i in missing])
+            except asyncio.TimeoutError:
+                return summaries
+            for i, summary in zip(missing, packed):
+                if summary is not None:
+                    summaries[i] = summary
+                    self.store_summary(documents[i], keys[i], summary)
+            missing = [i for i in missing if summaries[i] is None]
+            if missing:
+                logging.warning(f"The packed summaries of {self.entity} miss {len(missing)} documents, summarizing them alone")
+
+        async def alone(i):
+            try:
+                summaries[i] = await self.summarize_document(documents[i])
+            except asyncio.TimeoutError:
+                return
+            self.store_summary(documents[i], keys[i], summaries[i])
 
-        message = await self.client.messages.create(
-            model="anthropic.claude-3-haiku-20240307-v1:0",
-            max_tokens=1256,
-            messages=[{"role": "user", "content": content}]
-        )
-        return message.content
+        await asyncio.gather(*[alone(i) for i in missing])
+        return summaries
     
+    async def reduce_summaries(self, summaries):
+        """
+        Asynchronously shrinks a list of summaries until it fits in the report prompt budget, by merging batches of summaries
+        that each fit the budget in parallel, then merging the merged summaries, and so on. The number of rounds grows with log(N).
+
+        Args:
+            summaries (List[str]): The document summaries, each ending with its source URLs.
+
+        Returns:
+            List[str]: Summaries whose total size fits REPORT_TOKEN_BUDGET, or a single summary.
+        """
+        summaries = [summary for summary in summaries if summary]
+        while len(summaries) > 1 and sum(estimate_tokens(summary) for summary in summaries) > REPORT_TOKEN_BUDGET:
+            batches = [[]]
+            batch_tokens = 0
+            for summary in summaries:
+                tokens = estimate_tokens(summary)
+                if batches[-1] and batch_tokens + tokens > REPORT_TOKEN_BUDGET:
+                    batches.append([])
+                    batch_tokens = 0
+                batches[-1].append(summary)
+                batch_tokens += tokens
+            if len(batches) == len(summaries):
+                # every summary fills the budget alone, merge them two by two so that each round still halves the list
+                batches = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+            logging.info(f"Reducing {len(summaries)} summaries of {self.entity} in {len(batches)} batches")
+            summaries = await asyncio.gather(*[self.reduce_batch(batch) if len(batch) > 1 else asyncio.sleep(0, batch[0])
+                                               for batch in batches])
+        return summaries
+
+    async def reduce_batch(self, summaries) -> str:
+        """
+        Asynchronously merges a batch of summaries into one, keeping the facts and their source URLs.
+        """
+        content = REDUCE_TEMPLATE.format(summaries=format_summaries(summaries), entity=self.entity)
+        with span('reduce', entity=self.entity, summaries=len(summaries)):
+            message = await self.create_message(
+                'reduce',
+                model=REPORT_MODEL,
+                max_tokens=1256,
+                messages=[{"role": "user", "content": content}]
+            )
+        record_usage('reduce', message)
+        return message.content[0].text
+
     async def generate_report(self, summaries) -> str:
         """
         Asynchronously generates a final, consolidated summary report based on multiple input summaries, focusing specifically on KYC (Know Your Customer) risk factors.
         Args:
-            summaries (str): A string containing all the individual summaries that need to be consolidated into a final report.
+            summaries (List[str]): The individual summaries that need to be consolidated into a final report. They are first reduced by reduce_summaries
+                when they do not fit in one prompt.
         Returns:
             str: The consolidated summary as generated by the language model, formatted to include key risk-related facts and their corresponding URL links for easy reference and verification.
         """
         
-        content = f""" You are a professional KYC analyst who generates well-structured analysis reports that are detailed, thorough, in-depth, and complex, while maintaining clarity and conciseness.
+        with span('report', entity=self.entity, summaries=len(summaries)):
+            summaries = await self.reduce_summaries(summaries)
+            content = REPORT_TEMPLATE.format(summaries=format_summaries(summaries), entity=self.entity)
+            
+            message = await self.create_message(
+                'report',
+                model=REPORT_MODEL,
+                max_tokens=1256,
+                messages=[{"role": "user", "content": content}]
+            )
+        record_usage('report', message)
+        return message.content[0].text
 
-        You are a professional KYC analyst who generates well-structured analysis reports that are detailed, thorough, in-depth, and complex, while maintaining clarity and conciseness.
+    async def stream_report(self, summaries):
+        """
+        Asynchronously generates the same report as generate_report, yielding its text as the model produces it.
+        Args:
+            summaries (List[str]): The individual summaries to consolidate into the final report.
+        Yields:
+            str: The successive text fragments of the report.
+        Raises:
+            asyncio.TimeoutError: The report did not finish within the latency budget left.
+        """
+        # not a span: the consumer of the generator may resume it from another context
+        start = time.perf_counter()
+        remaining = self.remaining()
+        deadline = None if remaining is None else asyncio.get_running_loop().time() + remaining
+        try:
+            async with asyncio.timeout(deadline) as timeout:
+                summaries = await self.reduce_summaries(summaries)
+                content = REPORT_TEMPLATE.format(summaries=format_summaries(summaries), entity=self.entity)
+                async with self.client.messages.stream(
+                    model=REPORT_MODEL,
+                    max_tokens=1256,
+                    messages=[{"role": "user", "content": content}]
+                ) as stream:
+                    async for text in stream.text_stream:
+                        # the deadline only runs inside the generator, never while the consumer handles a fragment
+                        timeout.reschedule(None)
+                        yield text
+                        timeout.reschedule(deadline)
+                    record_usage('report', await stream.get_final_message())
+        except asyncio.TimeoutError:
+            if timeout.expired():
+                DEADLINES.labels('report').inc()
+            raise
+        STAGE_SECONDS.labels('report').observe(time.perf_counter() - start)
 
-        After conducting a web search, we have these web pages {summaries} containing information extracted from the web. Please generate a very detailed report of:
-        - All sanctions taken against {self.entity} that could pose a risk for a trading company. And if in you knowledge, you know sanctions taken for illegal facts, you must list some sanctions.
+    def cached_summary(self, document):
+        """
+        Returns the summary key of a document and its summary from the last screening or the summary cache, or None.
+        The key holds the URL of the document but not those of its duplicates, which the pipeline finds in any order.
+        """
+        key = summary_cache_key(document.page_content, document.metadata.get('source', ''), self.entity, SUMMARY_PROMPT_VERSION, SUMMARY_MODEL)
+        known = self.previous['documents'].get(key) if self.previous else None
+        summary = known['summary'] if known else self.summary_cache.get(key)
+        record_cache_lookup('summary', summary is not None)
+        if summary is not None:
+            self.document_summaries[key] = {'sources': list(document.metadata.get('sources', [document.metadata.get('source', '')])), 'summary': summary}
+        return key, summary
 
-        - All relevant facts extracted and related/done by {self.entity} that are directly linked to fraud, corruption, illegal activities, etc.
+    def store_summary(self, document, key, summary):
+        self.summary_cache.put(key, summary)
+        self.document_summaries[key] = {'sources': list(document.metadata.get('sources', [document.metadata.get('source', '')])), 'summary': summary}
 
-        Use your existing knowledge and expertise to provide context and identify potential risks, making logical connections based on previous KYC analyses.
+    def load_previous_screening(self):
+        """
+        Loads the record of the last screening of the entity from the report store, so that the summaries of the documents
+        that did not change are reused.
+        """
+        if self.report_store is not None and self.previous is None:
+            self.previous = self.report_store.get(self.entity, self.key_words)
 
-        If {self.entity} is not associated with any concerning facts, only return that it does not present a particular risk and do not include summaries of web pages about {self.entity}.
+    def summaries_digest(self) -> str:
+        """
+        Returns the digest of the set of summarized documents, which changes when a document is new, modified or gone.
+        """
+        keys = '\n'.join(sorted(self.document_summaries))
+        return hashlib.sha256(f"{REPORT_PROMPT_VERSION}\n{keys}".encode('utf-8')).hexdigest()
 
-        Otherwise, return a detailed and well-organized final report that summarizes the information. For each piece of information, you must include the source link (URL) so that the reader can directly access the article.
+    def unchanged_report(self):
+        """
+        Returns the stored (report, risk_class) when the documents are the same as at the last screening, otherwise None.
+        """
+        if self.previous is not None and self.previous['report'] and self.previous['digest'] == self.summaries_digest():
+            logging.info(f"No new or changed document for {self.entity} since {time.ctime(self.previous['screened_at'])}, reusing its report")
+            record_cache_lookup('report', True)
+            return self.previous['report'], self.previous['risk_class']
+        if self.report_store is not None:
+            record_cache_lookup('report', False)
+        return None
 
-        Begin the report with the sentence: "The web search report and the risk level:"
-                
-        At the end of the report, also include a sentence justifying the risk level. If there were sanctions, automatically set the risk level to "High."
-        
-        The last line should only contain one of these words describing the risk class: Low, Medium, or High. Do not add the word "Risk."
+    def report_timed_out(self, summaries):
         """
-        
-        message = await self.client.messages.create(
-            model="anthropic.claude-3-haiku-20240307-v1:0",
-            max_tokens=1256,
-            messages=[{"role": "user", "content": content}]
-        )
-        return message.content[0].text
+        Returns the partial report, without risk class, of a screening whose reduce or report call ran out of time: the
+        summaries completed so far, which are not lost with the report.
+        """
+        reason = f"the report could not be generated in time, here are the summaries of the {len(summaries)} pages read"
+        logging.warning(f"Report of {self.entity} timed out, returning its {len(summaries)} summaries")
+        if self.partial is not None:
+            reason = f"{self.partial}; {reason}"
+        self.partial = reason
+        return partial_report(format_summaries(summaries), reason)
 
-    async def summarize_documents(self):
+    def unassessed_reason(self):
         """
-        Asynchronously summarizes multiple documents by executing multiple document summarization tasks in parallel
-        
-        Returns:
-        List[str]: A list of strings where each string is a summary of one document, focusing on elements relevant to KYC (Know Your Customer) compliance risks.
+        Returns why a screening without summaries cannot rate the entity, or None when pages were read and the router dropped them all.
+        """
+        if self.partial is not None:
+            return self.partial
+        if self.dropped:
+            return None
+        if not self.urls:
+            return "the web search found no page"
+        if not self.loaded:
+            return f"none of the {len(self.urls)} pages found could be loaded"
+        return f"none of the {self.loaded} pages read mentions {self.entity}"
+
+    def save_screening(self, report, risk_class):
+        if self.report_store is not None:
+            self.report_store.save(self.entity, self.key_words, self.urls, self.document_summaries, report, risk_class, self.summaries_digest())
 
+    async def pipeline(self, summarize=True):
         """
-    
-        tasks = [self.summarize_document(doc) for doc in self.docs]
-        summaries = await asyncio.gather(*tasks)
-        return summaries
+        Asynchronously runs the search, the page loads and the summaries as connected stages instead of one after the other:
+        every page is loaded as soon as the query that found it returns, then reduced to its relevant passages, routed, compared with
+        the pages kept before for near duplicates, and summarized as soon as it is kept, packed with the other documents
+        kept within SUMMARY_PACK_LINGER seconds up to SUMMARY_PACK_TOKENS input tokens. The bounded queues between
+        the stages hold back a stage that runs ahead of the next one. Documents already loaded are only summarized.
+        When only the report reserve is left of the latency budget, the stages are cancelled and the screening is marked partial.
+
+        Args:
+            summarize (bool): False to stop after the deduplication, leaving the kept documents in self.docs without summarizing
+                them, as SummaryBatch prepares its requests.
+
+        Yields:
+            Tuple[str, dict]: A "queries" event, a "urls" event with the URLs found so far after every new search result, and a
+                "summary" event per summarized document. The summaries are also collected in self.summaries.
+        """
+        urls = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        documents = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        packs = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        events = asyncio.Queue()
+        duplicates = DuplicateFilter(threshold=DEDUP_THRESHOLD)
+        running = {'fetch': PIPELINE_FETCH_WORKERS}
+        self.summaries = []
+
+        async def search():
+            with span('search', entity=self.entity) as attributes:
+                async for result in self.search_manager.iter_search():
+                    self.urls.append(result["href"])
+                    await events.put(("urls", {"urls": list(self.urls)}))
+                    await urls.put(result["href"])
+                attributes['results'] = len(self.urls)
+                attributes['signals'] = self.search_manager.signals
+            for _ in range(PIPELINE_FETCH_WORKERS):
+                await urls.put(None)
+
+        async def fetch():
+            while (url := await urls.get()) is not None:
+                with span('fetch_page', entity=self.entity, source=url):
+                    document = await self.fetcher.load_document(url, page_cache=clients.get('page_cache'))
+                if document is not None:
+                    self.loaded += 1
+                    document = extract_passages(document, self.entity, self.key_words, self.aliases, PASSAGE_TOKEN_BUDGET)
+                if document is None:
+                    continue
+                # routed before deduplication, so that a copy on a denied domain never hides the same story on a kept one
+                if not self.router.is_relevant(document, self.entity, self.key_words, self.aliases):
+                    self.dropped.append(document)
+                    logging.info(f"Skipping {document.metadata.get('source', '')} for {self.entity}: {document.metadata['relevance']}")
+                elif duplicates.add(document):
+                    self.docs.append(document)
+                    await documents.put(document)
+            running['fetch'] -= 1
+            if running['fetch'] == 0:
+                self.is_loaded = True
+                await documents.put(None)
+
+        async def feed():
+            for document in self.docs:
+                await documents.put(document)
+            await documents.put(None)
 
-    async def process_documents(self):
+        async def pack():
+            pending, tokens, deadline = [], 0, None
+            getter = asyncio.ensure_future(documents.get())
+            try:
+                while True:
+                    done, _ = await asyncio.wait({getter}, timeout=None if not pending else max(0.0, deadline - time.monotonic()))
+                    if done:
+                        document = getter.result()
+                        if document is None:
+                            break
+                        getter = asyncio.ensure_future(documents.get())
+                        cost = estimate_tokens(document.page_content)
+                        if pending and tokens + cost > SUMMARY_PACK_TOKENS:
+                            await packs.put(pending)
+                            pending, tokens = [], 0
+                        if not pending:
+                            deadline = time.monotonic() + SUMMARY_PACK_LINGER
+                        pending.append(document)
+                        tokens += cost
+                    if pending and (not done or tokens >= SUMMARY_PACK_TOKENS):
+                        await packs.put(pending)
+                        pending, tokens = [], 0
+            finally:
+                getter.cancel()
+            if pending:
+                await packs.put(pending)
+            for _ in range(PIPELINE_SUMMARY_WORKERS):
+                await packs.put(None)
+
+        async def summarizer():
+            while (documents_pack := await packs.get()) is not None:
+                for document, summary in zip(documents_pack, await self.summarize_pack(documents_pack)):
+                    if summary is None:
+                        continue
+                    self.summaries.append(summary)
+                    await events.put(("summary", {"source": document.metadata.get("source", ""), "summary": summary}))
+            await events.put(("done", None))
+
+        async def drain():
+            while await documents.get() is not None:
+                pass
+            await events.put(("done", None))
+
+        async def supervised(stage):
+            try:
+                await stage
+            except Exception as e:
+                await events.put(("error", e))
+
+        if self.is_loaded:
+            stages = [feed()]
+        else:
+            self.search_manager = SearchManager(entity_name=self.entity, key_words=self.key_words)
+            self.urls, self.docs, self.dropped, self.loaded = [], [], [], 0
+            yield "queries", {"queries": [self.search_manager.clean_search_query(query) for query in self.search_manager.build_queries()]}
+            stages = [search()] + [fetch() for _ in range(PIPELINE_FETCH_WORKERS)]
+        if summarize:
+            stages += [pack()] + [summarizer() for _ in range(PIPELINE_SUMMARY_WORKERS)]
+        else:
+            stages += [drain()]
+        tasks = [asyncio.ensure_future(supervised(stage)) for stage in stages]
+        try:
+            finished = 0
+            while finished < (PIPELINE_SUMMARY_WORKERS if summarize else 1):
+                try:
+                    event, data = await asyncio.wait_for(events.get(), timeout=self.remaining(reserve=True))
+                except asyncio.TimeoutError:
+                    if self.is_loaded:
+                        self.budget_exceeded('summarize_documents', f"only {len(self.summaries)} of {len(self.docs)} pages were summarized in time")
+                    else:
+                        self.budget_exceeded('pipeline', f"the web search and the page loads did not finish in time, {len(self.summaries)} pages were summarized")
+                    return
+                if event == "error":
+                    raise data
+                if event == "done":
+                    finished += 1
+                    continue
+                yield event, data
+        finally:
+            for task in tasks:
+                task.cancel()
+        logging.info(f"Pipeline of {self.entity}: {len(self.urls)} pages found, {len(self.docs)} kept, {len(self.dropped)} dropped, "
+                     f"{len(self.summaries)} summarized")
+        if summarize and len(self.summaries) < len(self.docs):
+            self.budget_exceeded('summarize_documents', f"only {len(self.summaries)} of {len(self.docs)} pages were summarized in time")
+
+    async def process_documents(self, budget=LATENCY_BUDGET):
         """
         Asynchronously processes a series of documents to generate a consolidated report summarizing KYC risk-related information.
+        On a re-screening, only new or changed documents are summarized, and the stored report is returned as is when no document changed.
+        Documents judged irrelevant by the local router are never summarized, and an entity without relevant documents gets a Low report
+        without calling the model. The search, page loads and summaries overlap in the stages of pipeline.
+
+        Args:
+            budget (float): The seconds the screening may take, 0 for no limit. When the search or the summaries overrun it, the report
+                is generated from the summaries completed so far and flagged partial, and it is not stored for re-screenings.
+                When no summary completed and no page was read and dropped by the router, the entity is not assessed: its partial
+                report has no risk class and is not stored. When the report itself runs out of time, the partial report holds
+                the summaries completed, also without risk class.
 
         Returns:
-            str: A final consolidated report composed of key KYC risk-related information extracted and summarized from multiple documents.
+            Tuple[str, Optional[str]]: A final consolidated report composed of key KYC risk-related information extracted and summarized from multiple documents.
 
         """
-        if not self.is_loaded:
-            await self.initialize()
-        summaries = await self.summarize_documents()
-        report = await self.generate_report(summaries)
+        self.start_budget(budget)
+        match = await self.screen_sanctions()
+        if match is not None:
+            return sanctions_report(self.entity, match), "High"
+        self.load_previous_screening()
+        async for _ in self.pipeline():
+            pass
+        summaries = self.summaries
+        reason = self.unassessed_reason() if not summaries else None
+        if reason is not None:
+            return not_assessed_report(self.entity, reason), None
+        unchanged = self.unchanged_report() if self.partial is None else None
+        if unchanged is not None:
+            return unchanged
+        if summaries:
+            try:
+                report = await self.generate_report(summaries)
+            except asyncio.TimeoutError:
+                return self.report_timed_out(summaries), None
+        else:
+            report = no_adverse_media_report(self.entity, self.loaded)
         risk_class = report.split()[-1]
+        if self.partial is not None:
+            return partial_report(report, self.partial), risk_class
+        self.save_screening(report, risk_class)
         return report, risk_class
 
+    async def stream_documents(self, budget=LATENCY_BUDGET):
+        """
+        Asynchronously runs the same pipeline as process_documents, yielding progress events as soon as each step produces them.
+
+        Yields:
+            Tuple[str, dict]: The event name and its payload: "queries", then "urls" with the URLs found so far every time the
+                search finds a page, mixed with one "summary" per document as it completes, then the "report_token" fragments of the report, then the final "report" with its risk class. An entity found on a
+                sanctions list only gets a "sanctions" event with the match, then its "report". When no document changed since
+                the last screening, the stored "report" comes without "report_token" events.
+        """
+        self.start_budget(budget)
+        match = await self.screen_sanctions()
+        if match is not None:
+            yield "sanctions", {"match": match}
+            yield "report", {"summary": sanctions_report(self.entity, match), "class": "High", "partial": False}
+            return
+        self.load_previous_screening()
+        async for event, data in self.pipeline():
+            yield event, data
+        summaries = self.summaries
+
+        reason = self.unassessed_reason() if not summaries else None
+        if reason is not None:
+            report = not_assessed_report(self.entity, reason)
+            yield "report_token", {"text": report}
+            yield "report", {"summary": report, "class": None, "partial": True}
+            return
+        unchanged = self.unchanged_report() if self.partial is None else None
+        if unchanged is not None:
+            yield "report", {"summary": unchanged[0], "class": unchanged[1], "partial": False}
+            return
+        report = ""
+        if self.partial is not None:
+            report = partial_report("", self.partial)
+            yield "report_token", {"text": report}
+        if summaries:
+            try:
+                async for text in self.stream_report(summaries):
+                    report += text
+                    yield "report_token", {"text": text}
+            except asyncio.TimeoutError:
+                yield "report", {"summary": self.report_timed_out(summaries), "class": None, "partial": True}
+                return
+        else:
+            report += no_adverse_media_report(self.entity, self.loaded)
+        if self.partial is None:
+            self.save_screening(report, report.split()[-1])
+        yield "report", {"summary": report, "class": report.split()[-1], "partial": self.partial is not None}
+
+async def screen_entity(entity, client, key_words):
+    """
+    Asynchronously screens an entity, joining the screening of the same entity and key words already running or finished
+    less than SCREENING_REUSE_SECONDS ago instead of starting another one.
+
+    Returns:
+        Tuple[str, str]: The report and its risk class.
+    """
+    key = (normalize_entity(entity), key_words)
+    return await screenings.run(key, lambda: DocumentProcessor(entity=entity, client=client, key_words=key_words).process_documents())
+
 async def KYCwebreport(entity, client):
     key_words='fraud, corruption, financial crimes'
-    processor = DocumentProcessor(entity=entity, client=client, key_words=key_words)
-    processed_docs = await processor.process_documents()
+    processed_docs = await screen_entity(entity, client, key_words)
     return processed_docs
 
+async def KYCbatchreport(entities, client, key_words, semaphore):
+    """
+    Asynchronously screens a list of entities, running at most as many pipelines at once as the semaphore allows.
+
+    Args:
+        entities (List[str]): The entity names to screen.
+        client: The Anthropic client shared by every screening of the batch.
+        key_words (str): The risk key words used to build the search queries.
+        semaphore (asyncio.Semaphore): The concurrency limit shared by all the batches of the process.
+
+    Returns:
+        List: For each entity, in input order, the (report, risk_class) tuple or the exception raised while screening it.
+    """
+    async def screen(entity):
+        async with semaphore:
+            return await screen_entity(entity, client, key_words)
+
+    tasks = [screen(entity) for entity in entities]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
 async def main():
     start=time.time()
     entity='Zidane'
-    report, risk_class = await KYCwebreport(entity=entity, client=client)
+    report, risk_class = await KYCwebreport(entity=entity, client=clients.anthropic())
     end=time.time()
     print(report)
     print(end-start)
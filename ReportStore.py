@@ -0,0 +1,60 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+from TextUtils import normalize_entity
+
+class ReportStore:
+    """Record of the last screening of every entity, stored in a SQLite file, used to re-screen incrementally.
+
+    A record is keyed by the normalized entity name and the key words. It holds the URLs returned by the search, the
+    summary of every document with its summary key and sources, and the last report with its risk class and the
+    digest of the set of summaries it was generated from.
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS screenings (
+                entity_key TEXT, key_words TEXT, entity_name TEXT, urls TEXT,
+                report TEXT, risk_class TEXT, digest TEXT, screened_at REAL,
+                PRIMARY KEY (entity_key, key_words));
+            CREATE TABLE IF NOT EXISTS documents (
+                entity_key TEXT, key_words TEXT, summary_key TEXT, sources TEXT, summary TEXT,
+                PRIMARY KEY (entity_key, key_words, summary_key));
+        """)
+        self.db.commit()
+
+    def get(self, entity: str, key_words: str) -> Optional[dict]:
+        """
+        Returns the last screening of an entity, with its documents as a {summary_key: {"sources", "summary"}} dict, or None.
+        """
+        key = normalize_entity(entity)
+        with self.lock:
+            row = self.db.execute("""SELECT entity_name, urls, report, risk_class, digest, screened_at FROM screenings
+                                     WHERE entity_key = ? AND key_words = ?""", (key, key_words)).fetchone()
+            if row is None:
+                return None
+            documents = self.db.execute("SELECT summary_key, sources, summary FROM documents WHERE entity_key = ? AND key_words = ?",
+                                        (key, key_words)).fetchall()
+        entity_name, urls, report, risk_class, digest, screened_at = row
+        return {'entity_name': entity_name, 'urls': json.loads(urls), 'report': report, 'risk_class': risk_class,
+                'digest': digest, 'screened_at': screened_at,
+                'documents': {summary_key: {'sources': json.loads(sources), 'summary': summary} for summary_key, sources, summary in documents}}
+
+    def save(self, entity: str, key_words: str, urls: List[str], documents: Dict[str, dict], report: str, risk_class: str, digest: str):
+        """
+        Replaces the record of an entity by the result of its latest screening.
+        """
+        key = normalize_entity(entity)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO screenings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (key, key_words, entity, json.dumps(urls), report, risk_class, digest, time.time()))
+            self.db.execute("DELETE FROM documents WHERE entity_key = ? AND key_words = ?", (key, key_words))
+            self.db.executemany("INSERT INTO documents VALUES (?, ?, ?, ?, ?)",
+                                [(key, key_words, summary_key, json.dumps(document['sources']), document['summary'])
+                                 for summary_key, document in documents.items()])
+            self.db.commit()
@@ -0,0 +1,385 @@
+import os
+import csv
+import time
+import math
+import asyncio
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional
+import xml.etree.ElementTree as ET
+from TextUtils import normalize_entity
+
+NGRAM = 3
+LEGAL_FORMS = {'ltd', 'limited', 'llc', 'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'plc', 'sa', 'ag',
+               'gmbh', 'bv', 'nv', 'spa', 'srl', 'sarl', 'jsc', 'pjsc', 'ojsc', 'cjsc', 'ooo', 'oao', 'zao', 'pao', 'ao',
+               'llp', 'lp', 'fze', 'fzco', 'the', 'of'}
+# files read together with the main file of their list rather than on their own
+OFAC_COMPANION_FILES = ('alt.csv', 'add.csv', 'sdn_comments.csv')
+
+def normalize_name(name: str) -> str:
+    """ Returns the form of a name compared against the lists
+        Args:
+    name (str): An entity name or alias.
+
+        Returns:
+    str: The normalized words of the name without legal forms, sorted so that "Putin, Vladimir" equals "Vladimir Putin".
+    """
+    words = normalize_entity(name).split()
+    kept = [word for word in words if word not in LEGAL_FORMS]
+    return ' '.join(sorted(kept or words))
+
+def ngrams(name: str) -> set:
+    padded = f" {name} "
+    return {padded[i:i + NGRAM] for i in range(max(1, len(padded) - NGRAM + 1))}
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+def _text(element, tag: str) -> str:
+    for child in element:
+        if _local(child.tag) == tag:
+            return (child.text or '').strip()
+    return ''
+
+def _entry(list_name: str, reference: str, names: List[str], program: str, kind: str = '') -> Optional[dict]:
+    names = [name for name in dict.fromkeys(name.strip() for name in names) if name]
+    if not names:
+        return None
+    return {'list': list_name, 'reference': reference, 'name': names[0], 'aliases': names[1:], 'program': program, 'type': kind}
+
+def _person_variants(name: str) -> List[str]:
+    # the lists write people as "SURNAME, Given names"
+    if ',' in name:
+        surname, given = name.split(',', 1)
+        return [name, f"{given.strip()} {surname.strip()}"]
+    return [name]
+
+def companion_path(directory: str, name: str) -> Optional[str]:
+    """ Returns the path of a companion file of the OFAC export in a directory, whatever the case of its name (ALT.CSV or alt.csv)
+    """
+    try:
+        names = os.listdir(directory or '.')
+    except OSError:
+        return None
+    return next((os.path.join(directory, found) for found in sorted(names) if found.lower() == name), None)
+
+def parse_ofac_csv(path: str) -> List[dict]:
+    """ Parses the SDN.CSV export of OFAC, with the aliases of the ALT.CSV file of the same directory
+    """
+    aliases = {}
+    alt_path = companion_path(os.path.dirname(path), 'alt.csv')
+    if alt_path is not None:
+        with open(alt_path, newline='', encoding='latin-1') as f:
+            for row in csv.reader(f):
+                if len(row) >= 4 and row[3].strip() not in ('', '-0-'):
+                    aliases.setdefault(row[0].strip(), []).append(row[3].strip())
+    entries = []
+    with open(path, newline='', encoding='latin-1') as f:
+        for row in csv.reader(f):
+            if len(row) < 4 or not row[0].strip().isdigit():
+                continue
+            reference, name, kind, program = (value.strip() for value in row[:4])
+            names = _person_variants(name) if kind == 'individual' else [name]
+            for alias in aliases.get(reference, []):
+                names.extend(_person_variants(alias) if kind == 'individual' else [alias])
+            entry = _entry('OFAC SDN', reference, names, program, kind)
+            if entry:
+                entries.append(entry)
+    return entries
+
+def parse_ofac_xml(path: str) -> List[dict]:
+    """ Parses the SDN.XML export of OFAC
+    """
+    entries = []
+    for _, element in ET.iterparse(path):
+        if _local(element.tag) != 'sdnEntry':
+            continue
+        names = [' '.join(part for part in (_text(element, 'firstName'), _text(element, 'lastName')) if part)]
+        programs = []
+        for child in element:
+            if _local(child.tag) == 'akaList':
+                for aka in child:
+                    names.append(' '.join(part for part in (_text(aka, 'firstName'), _text(aka, 'lastName')) if part))
+            elif _local(child.tag) == 'programList':
+                programs.extend((program.text or '').strip() for program in child)
+        entry = _entry('OFAC SDN', _text(element, 'uid'), names, ', '.join(programs), _text(element, 'sdnType').lower())
+        if entry:
+            entries.append(entry)
+        element.clear()
+    return entries
+
+def parse_uk_csv(path: str) -> List[dict]:
+    """ Parses the consolidated list of HM Treasury (ConList.csv), where every row is one name of a Group ID
+    """
+    groups = {}
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        rows = csv.reader(f)
+        header = None
+        for row in rows:
+            if header is None:
+                if 'Group ID' in row:
+                    header = {column: i for i, column in enumerate(row)}
+                continue
+            if len(row) < len(header):
+                continue
+            value = lambda column: row[header[column]].strip() if column in header else ''
+            given = ' '.join(value(f"Name {i}") for i in range(1, 6) if value(f"Name {i}"))
+            name = f"{value('Name 6')}, {given}" if given else value('Name 6')
+            group = groups.setdefault(value('Group ID'), {'names': [], 'program': value('Regime'), 'type': value('Group Type').lower()})
+            variants = _person_variants(name) if group['type'] == 'individual' else [name]
+            if value('Alias Type').lower().startswith('primary'):
+                group['names'][:0] = variants
+            else:
+                group['names'].extend(variants)
+    entries = [_entry('UK HMT', reference, group['names'], group['program'], group['type']) for reference, group in groups.items()]
+    return [entry for entry in entries if entry]
+
+def parse_eu_xml(path: str) -> List[dict]:
+    """ Parses the EU consolidated financial sanctions list (XML export of the FSF platform)
+    """
+    entries = []
+    for _, element in ET.iterparse(path):
+        if _local(element.tag) != 'sanctionEntity':
+            continue
+        names, programs, kind = [], [], ''
+        for child in element:
+            tag = _local(child.tag)
+            if tag == 'nameAlias':
+                names.append(child.get('wholeName') or ' '.join(part for part in (child.get('firstName'), child.get('lastName')) if part))
+            elif tag == 'regulation' and child.get('programme'):
+                programs.append(child.get('programme'))
+            elif tag == 'subjectType':
+                kind = child.get('code', '')
+        reference = element.get('euReferenceNumber') or element.get('logicalId', '')
+        entry = _entry('EU consolidated', reference, names, ', '.join(dict.fromkeys(programs)), kind)
+        if entry:
+            entries.append(entry)
+        element.clear()
+    return entries
+
+def parse_seco_xml(path: str) -> List[dict]:
+    """ Parses the Swiss SECO sanctions list (swiss-sanctions-list XML)
+    """
+    programs, targets = {}, []
+    for _, element in ET.iterparse(path):
+        tag = _local(element.tag)
+        if tag == 'sanctions-program':
+            name = next((child.text or '' for child in element if _local(child.tag) == 'program-name' and child.get('lang') == 'eng'), '')
+            for child in element:
+                if _local(child.tag) == 'sanctions-set':
+                    programs[child.get('ssid')] = name.strip()
+        elif tag == 'target':
+            names, kind = [], ''
+            for subject in element:
+                if _local(subject.tag) not in ('individual', 'entity', 'object'):
+                    continue
+                kind = _local(subject.tag)
+                for name in subject.iter():
+                    if _local(name.tag) != 'name':
+                        continue
+                    parts = {}
+                    for part in name:
+                        if _local(part.tag) == 'name-part':
+                            parts.setdefault(part.get('name-part-type', ''), []).append(_text(part, 'value'))
+                    whole = parts.get('whole-name') or parts.get('given-name', []) + parts.get('further-given-name', []) + parts.get('family-name', [])
+                    names.append(' '.join(part for part in whole if part))
+            targets.append((element.get('ssid', ''), element.get('sanctions-set-id', ''), names, kind))
+            element.clear()
+    entries = [_entry('SECO', reference, names, programs.get(sanctions_set, ''), kind) for reference, sanctions_set, names, kind in targets]
+    return [entry for entry in entries if entry]
+
+def parse_list_file(path: str) -> List[dict]:
+    """ Parses a sanctions list export, recognizing OFAC SDN (CSV or XML), UK HMT (CSV), EU consolidated (XML) and SECO (XML)
+        Args:
+    path (str): The downloaded file.
+
+        Returns:
+    List[dict]: One entry per listed subject with its list, reference, primary name, aliases, programme and type.
+    """
+    if path.lower().endswith('.xml'):
+        for _, element in ET.iterparse(path, events=('start',)):
+            root = _local(element.tag)
+            break
+        parsers = {'sdnList': parse_ofac_xml, 'export': parse_eu_xml, 'swiss-sanctions-list': parse_seco_xml}
+        if root not in parsers:
+            raise ValueError(f"Unknown sanctions list format {root!r} in {path}")
+        return parsers[root](path)
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        head = f.read(4096)
+    if 'Group ID' in head or head.startswith('Last Updated'):
+        return parse_uk_csv(path)
+    return parse_ofac_csv(path)
+
+def prefix_length(size: int, threshold: float) -> int:
+    """ Returns how many of the rarest n-grams of a name must be probed so that any name reaching the Dice threshold shares one of them
+    """
+    return size - math.ceil(threshold * size / (2 - threshold)) + 1
+
+class NameIndex:
+    """Character n-gram index over the names and aliases of one list file, built for lookups at `min_threshold` or above.
+
+    Every name is stored as the ranks of its n-grams, from the rarest to the most frequent in the file, and indexed
+    only under the rare prefix that any similar enough name must share (prefix filtering). A lookup reads the short
+    postings of the query's own prefix, discards the candidates whose first shared n-gram comes too late to reach
+    the threshold (positional filtering) and scores the others exactly. The index is never modified once built; a
+    new version of the file gets a new index.
+    """
+    def __init__(self, entries: List[dict], min_threshold: float = 0.8):
+        self.entries = entries
+        self.min_threshold = min_threshold
+        self.names = []
+        self.owners = array('I')
+        self.exact = {}
+        all_grams = []
+        frequencies = {}
+        for owner, entry in enumerate(entries):
+            for name in [entry['name']] + entry['aliases']:
+                normalized = normalize_name(name)
+                if not normalized:
+                    continue
+                self.exact.setdefault(normalized, []).append(len(self.names))
+                self.names.append((name, normalized))
+                self.owners.append(owner)
+                grams = ngrams(normalized)
+                all_grams.append(grams)
+                for gram in grams:
+                    frequencies[gram] = frequencies.get(gram, 0) + 1
+        self.rank = {gram: rank for rank, gram in enumerate(sorted(frequencies, key=lambda gram: (frequencies[gram], gram)))}
+        # the ranks of the n-grams of name i are ranks[offsets[i]:offsets[i + 1]], in increasing order
+        self.ranks = array('I')
+        self.offsets = array('I', [0])
+        postings = {}
+        for alias_id, grams in enumerate(all_grams):
+            ranks = sorted(self.rank[gram] for gram in grams)
+            for position, rank in enumerate(ranks[:prefix_length(len(ranks), min_threshold)]):
+                postings.setdefault(rank, []).extend((alias_id, position))
+            self.ranks.extend(ranks)
+            self.offsets.append(len(self.ranks))
+        self.postings = {rank: array('I', pairs) for rank, pairs in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, normalized: str, grams: set, threshold: float) -> List[tuple]:
+        """ Returns the (score, alias id) of the names whose n-gram Dice similarity to the query reaches the threshold
+        """
+        if normalized in self.exact:
+            return [(1.0, alias_id) for alias_id in self.exact[normalized]]
+        threshold = max(threshold, self.min_threshold)
+        # n-grams missing from the file are rarer than all the others and match nothing
+        missing = iter(range(-1, -len(grams) - 1, -1))
+        query = sorted(self.rank.get(gram) if gram in self.rank else next(missing) for gram in grams)
+        query_set = set(query)
+        size = len(query)
+        shortest, longest = math.ceil(threshold * size / (2 - threshold)), math.floor(size * (2 - threshold) / threshold)
+        ranks, offsets, postings = self.ranks, self.offsets, self.postings
+        seen = set()
+        matches = []
+        for i, rank in enumerate(query[:prefix_length(size, threshold)]):
+            pairs = postings.get(rank)
+            if pairs is None:
+                continue
+            for k in range(0, len(pairs), 2):
+                alias_id = pairs[k]
+                if alias_id in seen:
+                    continue
+                seen.add(alias_id)
+                start, end = offsets[alias_id], offsets[alias_id + 1]
+                other = end - start
+                if not shortest <= other <= longest:
+                    continue
+                # this is the first n-gram shared with the query, only it and the n-grams after it in both names can be shared
+                if min(size - i, other - pairs[k + 1]) < threshold * (size + other) / 2:
+                    continue
+                score = 2 * len(query_set.intersection(ranks[start:end])) / (size + other)
+                if score >= threshold:
+                    matches.append((score, alias_id))
+        return matches
+
+class SanctionsIndex:
+    """In-memory fuzzy index of the sanctions list files dropped in a directory.
+
+    Every file has its own NameIndex, so a new or updated file is parsed and indexed alone and then swapped in,
+    while lookups keep using the other lists. `refresh` rescans the directory, `arefresh` does it off the event
+    loop at most every `refresh_interval` seconds.
+    """
+    def __init__(self, directory: str, threshold: float = 0.9, refresh_interval: float = 300):
+        self.directory = directory
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.shards: Dict[str, NameIndex] = {}
+        self.signatures = {}
+        self.lock = threading.Lock()
+        self.refreshed_at = 0.0
+
+    def _signature(self, path: str) -> tuple:
+        paths = [path]
+        if path.lower().endswith('.csv'):
+            paths += [companion_path(os.path.dirname(path), name) for name in OFAC_COMPANION_FILES]
+        return tuple((os.path.getmtime(p), os.path.getsize(p)) if p is not None and os.path.exists(p) else None for p in paths)
+
+    def refresh(self) -> List[str]:
+        """ Indexes the list files that appeared or changed since the last scan and drops the removed ones
+            Returns:
+        List[str]: The paths of the files that were (re)indexed.
+        """
+        with self.lock:
+            self.refreshed_at = time.monotonic()
+            if not os.path.isdir(self.directory):
+                return []
+            paths = sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                           if name.lower().endswith(('.csv', '.xml')) and name.lower() not in OFAC_COMPANION_FILES)
+            updated = []
+            for path in paths:
+                signature = self._signature(path)
+                if self.signatures.get(path) == signature:
+                    continue
+                start = time.perf_counter()
+                try:
+                    shard = NameIndex(parse_list_file(path), min_threshold=self.threshold)
+                except Exception as e:
+                    logging.warning(f"Could not index sanctions list {path}: {e!r}")
+                    continue
+                self.shards[path] = shard
+                self.signatures[path] = signature
+                updated.append(path)
+                logging.info(f"Indexed {len(shard.entries)} subjects and {len(shard)} names of {path} in {time.perf_counter() - start:.2f}s")
+            for path in set(self.shards) - set(paths):
+                del self.shards[path]
+                del self.signatures[path]
+            return updated
+
+    async def arefresh(self):
+        if time.monotonic() - self.refreshed_at >= self.refresh_interval:
+            await asyncio.to_thread(self.refresh)
+
+    def lookup(self, name: str, threshold: Optional[float] = None, limit: int = 5) -> List[dict]:
+        """ Finds the listed subjects whose name or alias is similar to a name
+            Args:
+        name (str): The screened name.
+        threshold (float): The minimum n-gram Dice similarity, the index threshold by default.
+        limit (int): The maximum number of matches returned.
+
+            Returns:
+        List[dict]: The best matches, one per listed subject, with the matched name, its score and the list entry.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        normalized = normalize_name(name)
+        if not normalized:
+            return []
+        grams = ngrams(normalized)
+        best = {}
+        for path, shard in list(self.shards.items()):
+            for score, alias_id in shard.lookup(normalized, grams, threshold):
+                entry = shard.entries[shard.owners[alias_id]]
+                key = (path, shard.owners[alias_id])
+                if key not in best or score > best[key]['score']:
+                    best[key] = {'score': round(score, 3), 'matched_name': shard.names[alias_id][0], 'file': os.path.basename(path), **entry}
+        return sorted(best.values(), key=lambda match: -match['score'])[:limit]
+
+    def screen(self, entity: str, aliases: Optional[List[str]] = None) -> Optional[dict]:
+        """ Returns the best confident match of an entity or of one of its aliases, or None if it is not listed
+        """
+        matches = [match for name in [entity] + list(aliases or []) for match in self.lookup(name, limit=1)]
+        return max(matches, key=lambda match: match['score']) if matches else None
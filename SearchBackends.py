@@ -0,0 +1,158 @@
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional, Sequence
+from duckduckgo_search import AsyncDDGS
+from TextUtils import normalize_entity
+from Metrics import SEARCHES
+
+class SearchUnavailableError(RuntimeError):
+    """No search backend answered a query: they all failed or timed out, which is not the same as finding nothing."""
+
+class SearchBackend:
+    """A web search engine. `search` returns results as DuckDuckGo does, dictionaries with a title, an href and a body,
+    and may raise or hang: the hedged search bounds every call with the backend's `timeout`."""
+    name = 'backend'
+
+    def __init__(self, timeout: float = 8):
+        self.timeout = timeout
+
+    async def search(self, query: str, max_results: int) -> List[dict]:
+        raise NotImplementedError
+
+class DuckDuckGoBackend(SearchBackend):
+    name = 'duckduckgo'
+
+    async def search(self, query: str, max_results: int) -> List[dict]:
+        return await AsyncDDGS(proxy=None).text(keywords=query, region='wt-wt', safesearch='off', max_results=max_results) or []
+
+class GoogleCSEBackend(SearchBackend):
+    """Google Custom Search JSON API, through google-api-python-client which is only imported on first use."""
+    name = 'google'
+
+    def __init__(self, api_key: str, cse_id: str, timeout: float = 8):
+        super().__init__(timeout)
+        self.api_key = api_key
+        self.cse_id = cse_id
+        self.service = None
+
+    def _search(self, query: str, max_results: int) -> List[dict]:
+        if self.service is None:
+            from googleapiclient.discovery import build
+            self.service = build('customsearch', 'v1', developerKey=self.api_key, cache_discovery=False)
+        # the API returns at most 10 results per call
+        response = self.service.cse().list(q=query, cx=self.cse_id, num=min(max_results, 10)).execute()
+        return [{'title': item.get('title', ''), 'href': item['link'], 'body': item.get('snippet', '')}
+                for item in response.get('items', [])]
+
+    async def search(self, query: str, max_results: int) -> List[dict]:
+        return await asyncio.to_thread(self._search, query, max_results)
+
+class FixtureBackend(SearchBackend):
+    """Answers from recorded results, a JSON object mapping queries to result lists, for tests and offline runs.
+    Queries are compared in normalized form."""
+    name = 'fixture'
+
+    def __init__(self, results: Optional[Dict[str, List[dict]]] = None, path: Optional[str] = None, timeout: float = 8):
+        super().__init__(timeout)
+        if path is not None:
+            with open(path, encoding='utf-8') as f:
+                results = json.load(f)
+        self.results = {normalize_entity(query): items for query, items in (results or {}).items()}
+
+    async def search(self, query: str, max_results: int) -> List[dict]:
+        return list(self.results.get(normalize_entity(query), []))[:max_results]
+
+class HedgedSearch:
+    """Runs a query on several backends, the first one at once and the next one each time `hedge_delay` seconds pass
+    without a sufficient answer or as soon as a backend fails, and returns the first answer with at least `min_results`
+    results. Slower calls are then cancelled. When no answer is sufficient the largest one is returned.
+    """
+    def __init__(self, backends: Sequence[SearchBackend], hedge_delay: float = 1.5):
+        self.backends = list(backends)
+        self.hedge_delay = hedge_delay
+
+    async def _call(self, backend: SearchBackend, query: str, max_results: int) -> Optional[List[dict]]:
+        """ Returns the results of a backend, or None when it failed or timed out
+        """
+        try:
+            results = await asyncio.wait_for(backend.search(query, max_results), timeout=backend.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Search backend {backend.name} timed out after {backend.timeout}s on {query!r}")
+            SEARCHES.labels(backend.name, 'timeout').inc()
+            return None
+        except asyncio.CancelledError:
+            SEARCHES.labels(backend.name, 'cancelled').inc()
+            raise
+        except Exception as e:
+            logging.warning(f"Search backend {backend.name} failed on {query!r}: {e!r}")
+            SEARCHES.labels(backend.name, 'failed').inc()
+            return None
+        SEARCHES.labels(backend.name, 'answered').inc()
+        return results
+
+    async def search(self, query: str, max_results: int, min_results: int = 1) -> List[dict]:
+        """
+        Searches a query on the backends with hedging.
+
+        Args:
+            query (str): The cleaned search query.
+            max_results (int): The number of results asked to every backend.
+            min_results (int): The number of results of a sufficient answer.
+
+        Returns:
+            List[dict]: The results of the first sufficient answer, or of the largest answer.
+
+        Raises:
+            SearchUnavailableError: No backend answered, so an empty result would hide an outage.
+        """
+        remaining = iter(self.backends)
+        pending = set()
+        answers = []
+
+        def launch() -> bool:
+            backend = next(remaining, None)
+            if backend is None:
+                return False
+            pending.add(asyncio.ensure_future(self._call(backend, query, max_results)))
+            return True
+
+        launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    pending.discard(task)
+                    results = task.result()
+                    if results is None:
+                        continue
+                    if len(results) >= min_results:
+                        return results
+                    answers.append(results)
+                if not pending:
+                    launch()
+            if not answers:
+                raise SearchUnavailableError(f"No search backend answered {query!r}")
+            return max(answers, key=len)
+        finally:
+            for task in pending:
+                task.cancel()
+
+def build_backends(names: Sequence[str], timeout: float, google_api_key: Optional[str] = None, google_cse_id: Optional[str] = None,
+                   fixture_path: Optional[str] = None) -> List[SearchBackend]:
+    """ Returns the configured backends in hedging order, skipping those whose credentials or fixture file are missing
+    """
+    backends = []
+    for name in names:
+        if name == 'duckduckgo':
+            backends.append(DuckDuckGoBackend(timeout=timeout))
+        elif name == 'google' and google_api_key and google_cse_id:
+            backends.append(GoogleCSEBackend(google_api_key, google_cse_id, timeout=timeout))
+        elif name == 'fixture' and fixture_path:
+            backends.append(FixtureBackend(path=fixture_path, timeout=timeout))
+        else:
+            logging.info(f"Search backend {name!r} is unknown or not configured, skipping it")
+    return backends
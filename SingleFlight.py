@@ -0,0 +1,49 @@
+import time
+import asyncio
+from typing import Awaitable, Callable, Hashable
+from Metrics import record_cache_lookup
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single run whose result every caller receives.
+
+    The run is a task of its own, so a caller that goes away (a closed HTTP connection) does not cancel it for the
+    others. A successful result is also returned to the calls arriving within `reuse_window` seconds after the run
+    finished; a failure is shared by the callers that were waiting for it but never reused.
+    """
+    def __init__(self, name: str, reuse_window: float = 30):
+        self.name = name
+        self.reuse_window = reuse_window
+        self.inflight = {}
+        self.results = {}
+
+    async def run(self, key: Hashable, function: Callable[[], Awaitable]):
+        """
+        Returns the result of `function()` for this key, from the run in flight or the recent result if there is one.
+
+        Args:
+            key (Hashable): The identity of the work, such as the normalized entity name and the key words.
+            function (Callable): Starts the work, called only when no run of the key is in flight or recent.
+
+        Returns:
+            The result of the shared run.
+        """
+        finished = self.results.get(key)
+        if finished is not None and time.monotonic() - finished[0] < self.reuse_window:
+            record_cache_lookup(self.name, True)
+            return finished[1]
+        task = self.inflight.get(key)
+        record_cache_lookup(self.name, task is not None)
+        if task is None:
+            task = asyncio.ensure_future(function())
+            self.inflight[key] = task
+            task.add_done_callback(lambda task: self._finished(key, task))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        now = time.monotonic()
+        for expired in [k for k, (finished_at, _) in self.results.items() if now - finished_at >= self.reuse_window]:
+            del self.results[expired]
+        if self.reuse_window > 0 and not task.cancelled() and task.exception() is None:
+            self.results[key] = (now, task.result())
@@ -0,0 +1,154 @@
+"""Offline summaries of a portfolio through the Anthropic Message Batches API.
+
+`submit` searches and loads the documents of every entity, packs the documents whose summary is not cached yet into
+packed summarize requests and submits all of them as one batch job, saving its id and the summary keys of every
+request to a state file. `collect` waits for the batch to end and stores the summaries it returns in the summary
+cache, so that the screenings run afterwards (BulkScreening, the API) only call the model for their reports.
+
+    python SummaryBatch.py submit portfolio.csv --state batch.json
+    python SummaryBatch.py collect --state batch.json
+
+Bedrock has no batch endpoint, so the jobs go to the Anthropic API with the anthropic_api_key of the environment and
+BATCH_SUMMARY_MODEL, the same Haiku model as the Bedrock summaries, whose keys they share.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Iterable
+from BulkScreening import read_entities, BULK_KEY_WORDS
+
+BATCH_SUMMARY_MODEL = os.getenv('batch_summary_model', 'claude-3-haiku-20240307')
+BATCH_POLL_SECONDS = float(os.getenv('batch_poll_seconds', '60'))
+SUMMARY_BATCH_CONCURRENCY = int(os.getenv('summary_batch_concurrency', '8'))
+
+async def submit(entities: Iterable[str], key_words: str, client, state_path: str, concurrency: int = SUMMARY_BATCH_CONCURRENCY) -> dict:
+    """
+    Submits the summarize requests of the uncached documents of the entities as one batch job.
+
+    Args:
+        entities (Iterable[str]): The entity names.
+        key_words (str): The risk key words of the screenings, which select the documents.
+        client: An AsyncAnthropic client, whose messages.batches creates the job.
+        state_path (str): The JSON file receiving the batch id and the summary keys of every request.
+        concurrency (int): The number of entities searched and loaded at once.
+
+    Returns:
+        dict: The batch id, the number of requests and of documents submitted, and of documents already cached.
+    """
+    from ReportGenerator import DocumentProcessor, SUMMARY_PACK_TOKENS, pack_documents
+    semaphore = asyncio.Semaphore(concurrency)
+    requests, keys = [], {}
+    counts = {'documents': 0, 'cached': 0}
+
+    async def prepare(entity):
+        async with semaphore:
+            processor = DocumentProcessor(entity=entity, client=None, key_words=key_words)
+            if await processor.screen_sanctions() is not None:
+                return
+            # the search, page loads, routing and deduplication of the screenings, without their summarize stage
+            async for _ in processor.pipeline(summarize=False):
+                pass
+        missing = []
+        for document in processor.docs:
+            key, summary = processor.cached_summary(document)
+            if summary is None:
+                missing.append((key, document))
+            else:
+                counts['cached'] += 1
+        key_of = {id(document): key for key, document in missing}
+        # without packing every document is a request of its own
+        for pack in pack_documents([document for _, document in missing], SUMMARY_PACK_TOKENS):
+            custom_id = f"summary-{len(requests)}"
+            request = processor.summary_request(pack)
+            request['model'] = BATCH_SUMMARY_MODEL
+            requests.append({'custom_id': custom_id, 'params': request})
+            keys[custom_id] = [key_of[id(document)] for document in pack]
+            counts['documents'] += len(pack)
+
+    results = await asyncio.gather(*[prepare(entity) for entity in entities], return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error(f"Preparing the summaries of an entity failed: {result!r}")
+    if not requests:
+        logging.info("Every summary is cached already, nothing to submit")
+        return {'batch_id': None, 'requests': 0, **counts}
+    batch = await client.messages.batches.create(requests=requests)
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump({'batch_id': batch.id, 'requests': keys}, f)
+    logging.info(f"Submitted batch {batch.id} of {len(requests)} requests for {counts['documents']} documents")
+    return {'batch_id': batch.id, 'requests': len(requests), **counts}
+
+async def collect(state_path: str, client, poll_interval: float = BATCH_POLL_SECONDS) -> dict:
+    """
+    Waits for the batch of a state file to end and stores its summaries in the summary cache.
+
+    Returns:
+        dict: The number of summaries stored, of documents without a summary (failed or expired requests, or missing
+            from a packed answer, left to the screenings) and the seconds waited.
+    """
+    from Clients import clients
+    from ReportGenerator import split_packed_summaries
+    summary_cache = clients.get('summary_cache')
+    with open(state_path, encoding='utf-8') as f:
+        state = json.load(f)
+    start = time.monotonic()
+    while (batch := await client.messages.batches.retrieve(state['batch_id'])).processing_status != 'ended':
+        logging.info(f"Batch {batch.id} is {batch.processing_status}, {batch.request_counts}")
+        await asyncio.sleep(poll_interval)
+    counts = {'stored': 0, 'missing': 0}
+    seen = set()
+    async for entry in await client.messages.batches.results(state['batch_id']):
+        keys = state['requests'].get(entry.custom_id, [])
+        seen.add(entry.custom_id)
+        if entry.result.type != 'succeeded':
+            logging.warning(f"Batch request {entry.custom_id} {entry.result.type}")
+            counts['missing'] += len(keys)
+            continue
+        text = entry.result.message.content[0].text
+        summaries = [text] if len(keys) == 1 else split_packed_summaries(text, len(keys))
+        for key, summary in zip(keys, summaries):
+            if summary is None:
+                counts['missing'] += 1
+            else:
+                summary_cache.put(key, summary)
+                counts['stored'] += 1
+    counts['missing'] += sum(len(keys) for custom_id, keys in state['requests'].items() if custom_id not in seen)
+    return {**counts, 'waited_s': round(time.monotonic() - start, 3)}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Summarizes the documents of a portfolio offline through a batch job.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    submit_parser = commands.add_parser('submit', help="submit the summarize requests of a portfolio")
+    submit_parser.add_argument('input', help="CSV (column entity_name or first column) or JSONL (key entity_name) file of entities")
+    submit_parser.add_argument('--key-words', default=BULK_KEY_WORDS, help="risk key words of the screenings")
+    collect_parser = commands.add_parser('collect', help="wait for the batch and cache its summaries")
+    collect_parser.add_argument('--poll', type=float, default=BATCH_POLL_SECONDS, help="seconds between two status checks")
+    for command in (submit_parser, collect_parser):
+        command.add_argument('--state', default='summary_batch.json', help="state file of the batch")
+    return parser.parse_args(argv)
+
+async def run(args, client=None) -> dict:
+    from Clients import clients
+    from ReportGenerator import web_fetcher
+    client = client or clients.anthropic_api()
+    try:
+        if args.command == 'submit':
+            return await submit(read_entities(args.input), args.key_words, client, args.state)
+        return await collect(args.state, client, args.poll)
+    finally:
+        await clients.aclose()
+        await web_fetcher.close()
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    summary = asyncio.run(run(parse_args(argv)))
+    for key, value in summary.items():
+        print(f"{key:>16}: {value}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
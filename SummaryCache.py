@@ -0,0 +1,61 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+from TextUtils import normalize_entity
+
+def summary_cache_key(document_text: str, source: str, entity: str, prompt_version: str, model: str) -> str:
+    """ Returns the key of a document summary
+        Args:
+    document_text (str): The text of the summarized document.
+    source (str): The URL of the document, which the summary cites.
+    entity (str): The screened entity.
+    prompt_version (str): The version of the summary prompt, so that editing the prompt invalidates old summaries.
+    model (str): The model id used to summarize.
+
+        Returns:
+    str: A hex digest identifying the summary.
+    """
+    text_hash = hashlib.sha256(document_text.encode('utf-8')).hexdigest()
+    parts = [text_hash, source, normalize_entity(entity), prompt_version, model]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+class InMemorySummaryCache:
+    """LRU cache of document summaries kept in the memory of the process."""
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        summary = self.entries.get(key)
+        if summary is not None:
+            self.entries.move_to_end(key)
+        return summary
+
+    def put(self, key: str, summary: str):
+        self.entries[key] = summary
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class SQLiteSummaryCache:
+    """Cache of document summaries stored in a SQLite file, shared across restarts and processes."""
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT, created_at REAL)")
+        self.db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.db.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, summary: str):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)", (key, summary, time.time()))
+            self.db.commit()
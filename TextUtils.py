@@ -0,0 +1,50 @@
+import re
+import unicodedata
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'ocid', 'cmpid', 'ref_src')
+
+def normalize_url(url: str) -> str:
+    """ Returns a canonical form of an URL so that the same page reached through different links shares one key
+        Args:
+    url (str): The raw URL as returned by the search engine.
+
+        Returns:
+    str: The URL with a lowercase scheme and host, no default port, no fragment, no tracking parameters and a sorted query string.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and not (scheme == 'http' and parts.port == 80) and not (scheme == 'https' and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path or '/'
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/')
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith(TRACKING_PARAMS)]
+    return urlunsplit((scheme, host, path, urlencode(sorted(query)), ''))
+
+def normalize_entity(name: str) -> str:
+    """ Returns a canonical form of an entity name used as a cache or store key
+        Args:
+    name (str): The entity name as typed by the user.
+
+        Returns:
+    str: The name without accents, punctuation, case or repeated whitespace.
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    name = re.sub(r"[^\w\s]", ' ', name.casefold())
+    return ' '.join(name.split())
+
+def estimate_tokens(text: str) -> int:
+    """ Returns a rough number of tokens of a text for budgeting, about four characters per token for English prose
+        Args:
+    text (str): The text sent to or received from the model.
+
+        Returns:
+    int: The estimated number of tokens, at least 1.
+    """
+    return max(1, len(text) // 4)
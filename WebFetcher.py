@@ -0,0 +1,197 @@
+import os
+import time
+import codecs
+import asyncio
+import logging
+from html.parser import HTMLParser
+from typing import List, Optional
+from urllib.parse import urlsplit
+import aiohttp
+from langchain_core.documents import Document
+from PageCache import PageCache
+from Metrics import FETCH_BYTES, FETCHES, record_cache_lookup
+
+USER_AGENT = os.environ.get('USER_AGENT', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36')
+
+# not head: its end tag may be left out, which would skip the whole body; title and meta are handled on their own
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'template', 'svg'}
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'td', 'section', 'article', 'header', 'footer', 'aside', 'nav', 'blockquote',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'table', 'pre', 'hr', 'main', 'figure', 'figcaption'}
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML to text converter fed with the chunks of a response as they are downloaded.
+    Block elements end a line so that the text keeps the paragraph structure of the page."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipped = 0
+        self.in_title = False
+        self.title = ''
+        self.metadata = {}
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'html' and 'lang' in attrs:
+            self.metadata['language'] = attrs['lang']
+        elif tag == 'meta' and attrs.get('name') == 'description':
+            self.metadata['description'] = attrs.get('content') or 'No description found.'
+        elif tag == 'title':
+            self.in_title = True
+        if tag in SKIPPED_TAGS:
+            self.skipped += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self.in_title = False
+        if tag in SKIPPED_TAGS:
+            self.skipped = max(0, self.skipped - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        elif not self.skipped:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+class WebFetcher:
+    """Long-lived asynchronous fetcher of web pages shared by every screening of the process.
+
+    It keeps one aiohttp session with keep-alive connections, limits the number of parallel requests per host and
+    spaces them by `politeness_delay`, bounds every request with connect and total timeouts, stops reading a page
+    after `max_bytes` and converts the HTML to text while it is downloaded. A page that cannot be fetched is skipped.
+    """
+    def __init__(self, max_connections: int = 100, per_host: int = 4, politeness_delay: float = 0.25,
+                 total_timeout: float = 20, connect_timeout: float = 5, max_bytes: int = 2_000_000):
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.politeness_delay = politeness_delay
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.max_bytes = max_bytes
+        self.session = None
+        self.loop = None
+        self.host_semaphores = {}
+        self.host_next_slot = {}
+
+    def _session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.loop is not loop:
+            # a session is bound to its event loop, scripts running several asyncio.run get a new one per loop
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.per_host,
+                                             ttl_dns_cache=300, keepalive_timeout=30)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers={'User-Agent': USER_AGENT})
+            self.loop = loop
+            self.host_semaphores = {}
+            self.host_next_slot = {}
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def _polite_wait(self, host: str):
+        now = time.monotonic()
+        slot = max(now, self.host_next_slot.get(host, now))
+        self.host_next_slot[host] = slot + self.politeness_delay
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def fetch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> Optional[dict]:
+        """
+        Downloads a page and extracts its text.
+
+        Args:
+            url (str): The URL of the page.
+            etag (str): The ETag of the cached copy, sent as If-None-Match.
+            last_modified (str): The Last-Modified date of the cached copy, sent as If-Modified-Since.
+
+        Returns:
+            Optional[dict]: {"not_modified": True} on a 304, otherwise the text, metadata and validators of the page, or None if it could not be fetched.
+        """
+        session = self._session()
+        host = urlsplit(url).hostname or ''
+        semaphore = self.host_semaphores.setdefault(host, asyncio.Semaphore(self.per_host))
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        async with semaphore:
+            await self._polite_wait(host)
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        FETCHES.labels('not_modified').inc()
+                        return {'not_modified': True}
+                    response.raise_for_status()
+                    if response.content_type not in ('text/html', 'text/plain', 'application/xhtml+xml'):
+                        logging.info(f"Skipping {url}: unsupported content type {response.content_type}")
+                        return None
+                    try:
+                        decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+                    except LookupError:
+                        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+                    extractor = TextExtractor()
+                    size = 0
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        size += len(chunk)
+                        extractor.feed(decoder.decode(chunk))
+                        if size >= self.max_bytes:
+                            logging.info(f"Truncating {url} after {size} bytes")
+                            break
+                    extractor.feed(decoder.decode(b'', final=True))
+                    extractor.close()
+                    FETCH_BYTES.observe(size)
+                    FETCHES.labels('downloaded').inc()
+                    metadata = {'source': url, **extractor.metadata}
+                    if extractor.title:
+                        metadata['title'] = extractor.title.strip()
+                    return {'text': extractor.text(), 'metadata': metadata,
+                            'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+            except Exception as e:
+                logging.warning(f"Error fetching {url}: {e!r}")
+                FETCHES.labels('failed').inc()
+                return None
+
+    async def load_document(self, url: str, page_cache: Optional[PageCache] = None) -> Optional[Document]:
+        """
+        Loads one page as a Document, from the page cache when it is fresh, revalidating or downloading it otherwise.
+        """
+        entry = page_cache.get(url) if page_cache is not None else None
+        if page_cache is not None:
+            record_cache_lookup('page', entry is not None and entry['fresh'])
+        if entry is not None and entry['fresh']:
+            FETCHES.labels('cached').inc()
+            return Document(page_content=entry['text'], metadata=entry['metadata'])
+        page = await self.fetch(url, etag=entry and entry['etag'], last_modified=entry and entry['last_modified'])
+        if page is None:
+            if entry is not None:
+                # a stale page is better than no page
+                return Document(page_content=entry['text'], metadata=entry['metadata'])
+            return None
+        if page.get('not_modified'):
+            page_cache.revalidated(url)
+            return Document(page_content=entry['text'], metadata=entry['metadata'])
+        if page_cache is not None:
+            page_cache.put(url, page['text'], page['metadata'], etag=page['etag'], last_modified=page['last_modified'])
+        return Document(page_content=page['text'], metadata=page['metadata'])
+
+    async def load(self, urls: List[str], page_cache: Optional[PageCache] = None) -> List[Document]:
+        """
+        Loads multiple pages concurrently.
+
+        Args:
+            urls (List[str]): The URLs of the pages to load.
+            page_cache (PageCache): The cache consulted before downloading and filled with the downloaded pages.
+
+        Returns:
+            List[Document]: One document per URL that could be loaded, in input order.
+        """
+        docs = await asyncio.gather(*[self.load_document(url, page_cache) for url in urls])
+        return [doc for doc in docs if doc is not None]
@@ -1,44 +1,82 @@
-import nest_asyncio
-nest_asyncio.apply()
 import os
-import boto3
-from langchain_community.llms.bedrock import Bedrock
-from langchain_core.output_parsers import BaseOutputParser
-from typing import List
-import re
+from typing import List, Optional
+from collections import OrderedDict
+import time
+import logging
 from dotenv import load_dotenv
-from duckduckgo_search import AsyncDDGS
 import asyncio
+from TextUtils import normalize_url, normalize_entity
+from SearchBackends import HedgedSearch, build_backends
+from RelevanceRouter import build_lexicon
+from PassageExtractor import mentions
+from Metrics import span, record_cache_lookup
+from Clients import clients
 
 load_dotenv()
 
 
-aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
-aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-aws_session_token = os.getenv('AWS_SESSION_TOKEN')
-
-bedrock = boto3.client(service_name='bedrock-runtime',
-region_name='eu-central-1',
-aws_access_key_id=aws_access_key_id,
-aws_secret_access_key=aws_secret_access_key,
-aws_session_token=aws_session_token)
-
-llm_claude1 = Bedrock(client=bedrock, model_id="anthropic.claude-instant-v1")
-
-class QuestionListOutputParser(BaseOutputParser[List[str]]):
-    """Output parser for a list of numbered questions. This parser
-    will be used to formate the output of the LLM to generate queries"""
-    def parse(self, text: str) -> List[str]:
-        lines = re.findall(r"\d+\..*?(?:\n|$)", text)
-        return lines
-
-class DuckDuckGoSearchManager():
-    def __init__(self, entity_name: str, num_results: int, key_words: str, llm):
-        # logging.info("Initializing DuckDuckGoSearchManager.")
+SEARCH_CACHE_TTL = float(os.getenv('search_cache_ttl', '3600'))
+SEARCH_BACKENDS = os.getenv('search_backends', 'duckduckgo,google')
+SEARCH_TIMEOUT = float(os.getenv('search_timeout', '8'))
+SEARCH_HEDGE_DELAY = float(os.getenv('search_hedge_delay', '1.5'))
+SEARCH_FIXTURE_PATH = os.getenv('search_fixture_path')
+SEARCH_INITIAL_RESULTS = int(os.getenv('search_initial_results', '2'))
+SEARCH_DEEP_RESULTS = int(os.getenv('search_deep_results', '6'))
+SEARCH_DEEPEN_MIN_SIGNALS = int(os.getenv('search_deepen_min_signals', '1'))
+GOOGLE_CSE_ID = os.getenv('google_cse_id')
+GOOGLE_API_KEY = os.getenv('google_api_key')
+
+class SearchResultCache():
+    """In-memory cache of search results keyed by cleaned query and number of results.
+    Entries expire after `ttl` seconds and the oldest ones are dropped beyond `max_entries`."""
+    def __init__(self, ttl: float, max_entries: int = 4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[List[dict]]:
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.misses += 1
+            record_cache_lookup('search', False)
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        record_cache_lookup('search', True)
+        return list(entry[1])
+
+    def put(self, key, results: List[dict]):
+        self.entries[key] = (time.monotonic(), list(results))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+search_cache = SearchResultCache(ttl=SEARCH_CACHE_TTL)
+search_backends = HedgedSearch(build_backends([name.strip() for name in SEARCH_BACKENDS.split(',') if name.strip()], SEARCH_TIMEOUT,
+                                              google_api_key=GOOGLE_API_KEY, google_cse_id=GOOGLE_CSE_ID, fixture_path=SEARCH_FIXTURE_PATH),
+                               hedge_delay=SEARCH_HEDGE_DELAY)
+
+class SearchManager():
+    """Searches the web about an entity on the configured backends, progressively: every query first asks for
+    `num_results` results, and the search is deepened to `deep_results` results per query, with extra queries built
+    from the key words, only when the first results already show adverse signals."""
+    def __init__(self, entity_name: str, num_results: int = SEARCH_INITIAL_RESULTS, key_words: str = '', llm=None,
+                 backends: Optional[HedgedSearch] = None, deep_results: int = SEARCH_DEEP_RESULTS):
+        # logging.info("Initializing SearchManager.")
         self.entity_name = entity_name
         self.num_results = num_results
+        self.deep_results = deep_results
         self.key_words = key_words
         self.llm = llm
+        self.backends = backends or search_backends
+        self.deepened = False
+        self.signals = 0
     
     def build_queries(self):
         
@@ -70,6 +108,12 @@ class DuckDuckGoSearchManager():
         print(results)
 
         return results
+
+    def build_deep_queries(self) -> List[str]:
+        """
+        Returns the extra queries of a deepened search, one per risk key word.
+        """
+        return [f"{self.entity_name} {word.strip()}" for word in self.key_words.split(',') if word.strip()]
     
     def clean_search_query(self, query: str) -> str:
         """ Returns clean queries given by the LLM
@@ -90,23 +134,27 @@ class DuckDuckGoSearchManager():
         return cleaned_query
     
 
-    async def search_tool(self, query: str) -> List[dict]:
+    async def search_tool(self, query: str, num_results: Optional[int] = None) -> List[dict]:
         """
-        Performs a search using the DuckDuckGo search API and returns the results.
+        Performs a search hedged across the search backends and returns the results.
+        Results are served from the shared search cache when the same cleaned query was run recently.
         Args:
             query (str): The raw search query string.
+            num_results (int): The number of results to ask for, `num_results` of the manager by default.
 
         Returns:
             List[dict]: A list of dictionaries, each representing a search result.
         """
 
+        num_results = num_results or self.num_results
         search_query = self.clean_search_query(query)
-        results = await AsyncDDGS(proxy=None).text(
-            keywords=search_query,
-            region='wt-wt',
-            safesearch='off',
-            max_results=self.num_results
-        )
+        cache_key = (' '.join(search_query.lower().split()), num_results)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        with span('search_query', entity=self.entity_name) as attributes:
+            results = await self.backends.search(search_query, num_results)
+            attributes['results'] = len(results)
 
         #filtered_results=[]
         #for doc in results:
@@ -114,29 +162,78 @@ class DuckDuckGoSearchManager():
         #        filtered_results.append(doc)
         #return filtered_results
 
+        if results:
+            search_cache.put(cache_key, results)
         return results
 
+    def adverse_signals(self, results: List[dict]) -> int:
+        """
+        Counts the results whose title or snippet mentions the entity together with an adverse-media term.
+        """
+        pattern, _ = build_lexicon(self.key_words)
+        names = [normalize_entity(self.entity_name).split()]
+        signals = 0
+        for result in results:
+            text = normalize_entity(f"{result.get('title', '')} {result.get('body', '')}")
+            if pattern.search(text) and mentions(text, names):
+                signals += 1
+        return signals
+
+    async def iter_search(self):
+        """
+        Yields the unique search results, two results being duplicates when their normalized URLs are equal, as soon as the
+        query that found them returns, so that their pages can be loaded while the other queries run.
+        When at least SEARCH_DEEPEN_MIN_SIGNALS results of the first queries look adverse, the queries are run again for more
+        results, together with the deep queries, so that only entities with adverse media pay for a wider coverage.
+
+        Yields:
+        dict: A search result page, with its title, href and body.
+        """
+        queries = self.build_queries()
+        seen = set()
+        found = []
+        for round_queries, num_results in ((queries, None), (queries + self.build_deep_queries(), self.deep_results)):
+            tasks = [asyncio.ensure_future(self.search_tool(query, num_results)) for query in round_queries]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    docs = await task
+                    found += docs
+                    for res in docs:
+                        key = normalize_url(res["href"])
+                        if key not in seen:
+                            seen.add(key)
+                            yield res
+            finally:
+                for task in tasks:
+                    task.cancel()
+            if num_results is None:
+                self.signals = self.adverse_signals(found)
+                if self.signals < SEARCH_DEEPEN_MIN_SIGNALS:
+                    break
+                self.deepened = True
+        logging.info(f"Search cache: {search_cache.stats()}")
+
     async def perform_search(self) -> List[dict]:
         """    
         This function constructs multiple queries, performs a search for each, and collates the unique
-         results into a single list to avoid duplicates.
+         results into a single list to avoid duplicates, deepening the search like iter_search.
 
         Returns:
         List[dict]: A list of unique search result pages as dictionaries.
 
         """
-        queries = self.build_queries()
-        tasks = [self.search_tool(query) for query in queries]
-        search_results = await asyncio.gather(*tasks)
-        results = []
-        for docs in search_results:
-            results.extend([res for res in docs if res not in results])
+        with span('search', entity=self.entity_name) as attributes:
+            results = [res async for res in self.iter_search()]
+            attributes['signals'] = self.signals
+            attributes['results'] = len(results)
         return results
 
+# the manager was DuckDuckGo only before the search backends were pluggable
+DuckDuckGoSearchManager = SearchManager
 
 async def main():
     key_words = "fraud, corruption, illegal activities"
-    search_manager = DuckDuckGoSearchManager("Petrobras", num_results=2, key_words=key_words, llm=llm_claude1)
+    search_manager = SearchManager("Petrobras", key_words=key_words, llm=clients.llm())
     results = await search_manager.perform_search()
     print(results)
 
@@ -1,8 +1,22 @@
 import streamlit as st
 import requests
 import time 
+import json
 
 API_URL = "http://127.0.0.1:8000/process"
+STREAM_URL = "http://127.0.0.1:8000/process/stream"
+
+def sse_events(response):
+    """Yields the (event, data) pairs of a server-sent-event response as they arrive."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and data:
+            yield event, json.loads("\n".join(data))
+            event, data = "message", []
 
 background_image = """
 <style>
@@ -48,18 +62,45 @@ if st.sidebar.button("Generate KYC Report"):
     start_time = time.time()  
     if entity_name:
         data = {"entity_name": entity_name}
-        with st.spinner('Generating KYC Report...'):
-            response = requests.post(API_URL, json=data)
+        status = st.empty()
+        sources = st.expander("Sources")
+        report_frame = st.empty()
+        report = ""
+        shown = 0
+        status.info("Searching the web...")
+        with requests.post(STREAM_URL, json=data, stream=True) as response:
             if response.status_code == 200:
-                summary = response.json()["summary"]
-                risk_class = response.json()["class"]
-                risk_style = "low-risk" if risk_class == "Low" else "medium-risk" if risk_class == "Medium" else "high-risk"
-                #st.subheader("KYC Report:")
-                st.markdown(f'<div class="report-frame {risk_style}">{summary}</div>', unsafe_allow_html=True)
+                for event, payload in sse_events(response):
+                    if event == "sanctions":
+                        status.warning(f"Listed on the {payload['match']['list']} sanctions list, reference {payload['match']['reference']}")
+                    elif event == "urls":
+                        status.info(f"Found {len(payload['urls'])} pages, reading them...")
+                        # the list is cumulative, only the URLs found since the last event are written
+                        for url in payload["urls"][shown:]:
+                            sources.write(url)
+                        shown = len(payload["urls"])
+                    elif event == "summary":
+                        status.info(f"Summarized {payload['source']}")
+                    elif event == "report_token":
+                        report += payload["text"]
+                        report_frame.markdown(f'<div class="report-frame">{report}</div>', unsafe_allow_html=True)
+                    elif event == "report":
+                        summary = payload["summary"]
+                        risk_class = payload["class"]
+                        risk_style = "low-risk" if risk_class == "Low" else "medium-risk" if risk_class == "Medium" else "high-risk"
+                        if risk_class is None:
+                            status.error("The latency budget ran out before any page was read, the entity is not assessed")
+                        elif payload.get("partial"):
+                            status.warning("The latency budget ran out, this report covers only part of the pages found")
+                        else:
+                            status.empty()
+                        report_frame.markdown(f'<div class="report-frame {risk_style}">{summary}</div>', unsafe_allow_html=True)
+                    elif event == "error":
+                        status.error(f"Error while summarizing: {payload['detail']}")
             else:
                 st.error(f"Error while summarizing. Status code: {response.status_code}")
-            execution_time = time.time() - start_time 
-            st.sidebar.write(f"Execution Time: {execution_time:.2f} seconds") 
+        execution_time = time.time() - start_time 
+        st.sidebar.write(f"Execution Time: {execution_time:.2f} seconds") 
     else:
         st.sidebar.error("Please enter the name of the entity to generate the KYC report.")
         
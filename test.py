@@ -1,13 +1,14 @@
 import nest_asyncio
 import dotenv
 
-from langchain_community.document_loaders import WebBaseLoader
 from langchain.chains.llm import LLMChain
 from langchain_core.prompts import PromptTemplate
 import boto3
 from langchain_community.chat_models import BedrockChat
 from langchain.chains import MapReduceDocumentsChain, ReduceDocumentsChain
 from WebSearcher import DuckDuckGoSearchManager
+from PageCache import PageCache
+from WebFetcher import WebFetcher
 import logging
 import os
 import time
@@ -29,6 +30,12 @@ GOOGLE_API_KEY=os.getenv('google_api_key')
 aws_access_key_id = os.getenv('aws_access_key_id')
 aws_secret_access_key = os.getenv('aws_secret_access_key')
 aws_session_token = os.getenv('aws_session_token')
+PAGE_CACHE_DIR = os.getenv('page_cache_dir', '.kyc_cache/pages')
+PAGE_CACHE_TTL = float(os.getenv('page_cache_ttl', '86400'))
+PAGE_CACHE_MAX_MB = int(os.getenv('page_cache_max_mb', '256'))
+FETCH_PER_HOST = int(os.getenv('fetch_per_host', '4'))
+FETCH_TIMEOUT = float(os.getenv('fetch_timeout', '20'))
+FETCH_MAX_BYTES = int(os.getenv('fetch_max_bytes', '2000000'))
 
 bedrock = boto3.client(service_name='bedrock-runtime',
 region_name='us-east-1',
@@ -45,6 +52,9 @@ client = AsyncAnthropicBedrock(
 
 llm_claude3 = BedrockChat(client=bedrock, model_id="anthropic.claude-3-haiku-20240307-v1:0")
 
+page_cache = PageCache(directory=PAGE_CACHE_DIR, ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024)
+web_fetcher = WebFetcher(per_host=FETCH_PER_HOST, total_timeout=FETCH_TIMEOUT, max_bytes=FETCH_MAX_BYTES)
+
 class DocumentProcessor:
     def __init__(self, entity, client, key_words):
         self.entity = entity
@@ -63,14 +73,11 @@ class DocumentProcessor:
         )
         self.results = await self.search_manager.perform_search()
         self.urls = [result["href"] for result in self.results]
-        self.load_documents()
+        await self.load_documents()
         self.is_loaded = True
 
-    def load_documents(self):
-        loader = WebBaseLoader(self.urls, continue_on_failure=True)
-        loader.requests_per_second = 5
-        docs = loader.aload()
-        self.docs = docs
+    async def load_documents(self):
+        self.docs = await web_fetcher.load(self.urls, page_cache=page_cache)
 
     async def summarize_document(self, document):
         template1 = """
@@ -0,0 +1,14 @@
+"""Cold start of the API process: importing APIdocumentprocessor must stay within IMPORT_BUDGET seconds, measured by
+Benchmark.measure_import in fresh interpreters. Run with `python -m pytest test_import_budget.py`."""
+import os
+import shutil
+import Benchmark
+
+IMPORT_BUDGET = float(os.getenv('import_budget_seconds', '1.5'))
+
+def test_api_import_within_budget():
+    try:
+        elapsed = Benchmark.measure_import('APIdocumentprocessor')
+    finally:
+        shutil.rmtree(Benchmark.BENCHMARK_DIR, ignore_errors=True)
+    assert elapsed <= IMPORT_BUDGET, f"import APIdocumentprocessor took {elapsed:.3f}s, over the budget of {IMPORT_BUDGET:.3f}s"
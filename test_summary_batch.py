@@ -0,0 +1,85 @@
+"""Packed summaries and the offline summary batch, against the stand-ins of Benchmark: the local corpus server, the fake
+DuckDuckGo and the fake Bedrock client. Run with `python -m pytest test_summary_batch.py`."""
+import os
+import re
+import asyncio
+from types import SimpleNamespace
+import Benchmark
+from langchain_core.documents import Document
+
+KEY_WORDS = 'fraud, corruption'
+
+class DroppingMessages:
+    """Answers like the fake Bedrock client, leaving out the summary of the last document of every packed request."""
+    def __init__(self, bedrock):
+        self.bedrock = bedrock
+
+    async def create(self, **request):
+        message = await self.bedrock.messages.create(**request)
+        summaries = re.findall(r'<summary id="\d+">.*?</summary>', message.content[0].text, re.DOTALL)
+        if len(summaries) > 1:
+            message.content[0].text = '\n'.join(summaries[:-1])
+        return message
+
+def test_split_packed_summaries():
+    from ReportGenerator import split_packed_summaries
+    text = ('<summary id="2">Second article.</summary>\n<summary id="1"> First article. </summary>\n'
+            '<summary id="3">  </summary>\n<summary id="7">No such document.</summary>')
+    assert split_packed_summaries(text, 3) == ['First article.', 'Second article.', None]
+    assert split_packed_summaries("An answer without tags.", 2) == [None, None]
+
+def test_summarize_pack_summarizes_missing_documents_alone():
+    from ReportGenerator import DocumentProcessor
+    from SummaryCache import InMemorySummaryCache
+    bedrock = Benchmark.FakeAsyncAnthropicBedrock(latency=0.01, tokens_per_second=100_000, output_tokens=20)
+    processor = DocumentProcessor(entity='Acme Holdings', client=SimpleNamespace(messages=DroppingMessages(bedrock)),
+                                  key_words=KEY_WORDS, summary_cache=InMemorySummaryCache())
+    documents = [Document(page_content=f"Acme Holdings was fined for fraud in case {i}.", metadata={'source': f"http://news.example/{i}"})
+                 for i in range(3)]
+    summaries = asyncio.run(processor.summarize_pack(documents))
+    assert all(summaries)
+    # one packed request missing the third summary, then the third document alone
+    assert bedrock.stats.calls == 2
+    assert all(processor.cached_summary(document)[1] == summary for document, summary in zip(documents, summaries))
+
+def test_summary_batch_round_trip(tmp_path, monkeypatch):
+    import ReportGenerator
+    import SummaryBatch
+    # one page load at a time, so that every run keeps the same copy of the syndicated story, whose URL is part of its summary key
+    monkeypatch.setattr(ReportGenerator, 'PIPELINE_FETCH_WORKERS', 1)
+    args = Benchmark.parse_args(['--entities', '3', '--search-latency', '0.01', '--fetch-latency', '0.01',
+                                 '--llm-latency', '0.01', '--llm-tokens-per-second', '100000', '--rps', '0'])
+    entities = Benchmark.entity_names(args.entities)
+    server = Benchmark.CorpusServer(Benchmark.Corpus(pages_per_entity=args.pages_per_entity, paragraphs=args.paragraphs),
+                                    latency=args.fetch_latency)
+    server.start()
+    state_path = os.path.join(tmp_path, 'summary_batch.json')
+
+    async def round_trip():
+        bedrock, client = Benchmark.install_fakes(args, server.base_url, entities)
+        try:
+            submitted = await SummaryBatch.submit(entities, KEY_WORDS, bedrock, state_path)
+            collected = await SummaryBatch.collect(state_path, bedrock, poll_interval=0.01)
+            resubmitted = await SummaryBatch.submit(entities, KEY_WORDS, bedrock, state_path)
+            prompts, create = [], bedrock.messages.create
+
+            async def recorded(**request):
+                prompts.append(''.join(str(message['content']) for message in request['messages']))
+                return await create(**request)
+            bedrock.messages.create = recorded
+            for entity in entities:
+                await ReportGenerator.screen_entity(entity, client, KEY_WORDS)
+            return bedrock, submitted, collected, resubmitted, prompts
+        finally:
+            await ReportGenerator.web_fetcher.close()
+
+    try:
+        bedrock, submitted, collected, resubmitted, prompts = asyncio.run(round_trip())
+    finally:
+        server.stop()
+    assert submitted['documents'] > 0
+    assert bedrock.stats.batch_requests == submitted['requests'] < submitted['documents']
+    assert collected['stored'] == submitted['documents'] and collected['missing'] == 0
+    assert resubmitted['requests'] == 0 and resubmitted['cached'] == submitted['documents']
+    # the screenings find every summary in the cache and only call the model for their reports
+    assert prompts and not any('<document' in prompt for prompt in prompts)